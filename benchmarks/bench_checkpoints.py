@@ -0,0 +1,72 @@
+"""Messages/sec for scrape_channel with per-message vs coalesced checkpoints.
+
+"before" commits and saves state.json for every message like the old scrape
+loop did, "after" uses the default MessageWriter and CheckpointStore settings.
+
+    python benchmarks/bench_checkpoints.py --messages 20000
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import load_scraper
+from fake_telegram import FakeClient, synthetic_channel
+
+
+def run(scraper, writer_class, channel_id, batch_size, flush_interval, every, interval):
+    class Writer(writer_class):
+        def __init__(self, channel_id):
+            super().__init__(channel_id, batch_size=batch_size, flush_interval=flush_interval)
+
+    scraper.MessageWriter = Writer
+    scraper.checkpoints = scraper.CheckpointStore(every=every, interval=interval)
+    scraper.state['channels'][str(channel_id)] = 0
+    db_file = os.path.join(os.getcwd(), str(channel_id), f'{channel_id}.db')
+    if os.path.exists(db_file):
+        os.remove(db_file)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        asyncio.run(scraper.scrape_channel(str(channel_id), 0))
+        scraper.checkpoints.flush()
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--padding-channels', type=int, default=200,
+                        help='extra channel_details entries to make state.json realistic')
+    args = parser.parse_args()
+
+    channel_id = 1234567890
+    scraper, workdir = load_scraper([channel_id], extra_channels=args.padding_channels)
+    scraper.pool = scraper.SessionPool({scraper.PRIMARY_SESSION: FakeClient([synthetic_channel(channel_id, args.messages)])})
+    writer_class = scraper.MessageWriter
+
+    try:
+        results = [
+            ('before (save every message)',
+             run(scraper, writer_class, channel_id, batch_size=1, flush_interval=0, every=1, interval=0)),
+            ('after (coalesced checkpoints)',
+             run(scraper, writer_class, channel_id,
+                 batch_size=scraper.DB_BATCH_SIZE, flush_interval=scraper.DB_FLUSH_INTERVAL,
+                 every=scraper.CHECKPOINT_EVERY, interval=scraper.CHECKPOINT_INTERVAL)),
+        ]
+    finally:
+        os.chdir('/')
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    for name, elapsed in results:
+        print(f"{name:32} {args.messages / elapsed:10.0f} messages/sec ({elapsed:.2f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Full export of many channels, one after another vs across worker processes.
+
+Scrapes synthetic channels into their own databases, then times export_data
+with parallel export off and on. Parallel export should get close to
+--workers times faster (by default one worker per available core) as long
+as there are at least that many channels.
+
+The scraper is loaded as a module here rather than run as a script, so the
+worker processes are forked instead of spawned like they are in the app.
+
+    python benchmarks/bench_export.py --channels 16 --messages 20000 --format json
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import load_scraper
+from fake_telegram import FakeClient, synthetic_channel
+
+
+def timed_export(scraper, parallel):
+    scraper.state['parallel_export'] = parallel
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        asyncio.run(scraper.export_data(full=True))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channels', type=int, default=16)
+    parser.add_argument('--messages', type=int, default=20000, help='messages per channel')
+    parser.add_argument('--format', default='json', help='json, ndjson or parquet')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: available cores)')
+    args = parser.parse_args()
+
+    channel_ids = [1000000000 + i for i in range(args.channels)]
+    scraper, workdir = load_scraper(channel_ids)
+    scraper.EXPORT_START_METHOD = 'fork'
+    if args.workers:
+        scraper.export_worker_count = lambda channels: min(channels, args.workers)
+    scraper.state['export_format'] = args.format
+    scraper.pool = scraper.SessionPool({scraper.PRIMARY_SESSION: FakeClient(
+        [synthetic_channel(channel_id, args.messages) for channel_id in channel_ids])})
+
+    async def scrape_all():
+        await asyncio.gather(*(scraper.scrape_channel(str(channel_id), 0) for channel_id in channel_ids))
+
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            asyncio.run(scrape_all())
+        workers = scraper.export_worker_count(len(channel_ids))
+        sequential = timed_export(scraper, parallel=False)
+        parallel = timed_export(scraper, parallel=True)
+    finally:
+        scraper.checkpoints.flush()
+        os.chdir(os.path.dirname(workdir))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    total = args.channels * args.messages
+    print(f"{args.channels} channels x {args.messages} messages, {args.format} export")
+    print(f"sequential            {sequential:7.2f}s {total / sequential:10.0f} msg/s")
+    print(f"parallel ({workers:2} workers) {parallel:7.2f}s {total / parallel:10.0f} msg/s   "
+          f"speedup {sequential / parallel:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
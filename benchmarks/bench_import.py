@@ -0,0 +1,67 @@
+"""Startup cost of importing telegram-scraper.py, as a regression gate.
+
+Each run imports the script in a fresh interpreter (the same work done
+before the menu appears) and records wall time and peak RSS. The gate fails
+if any transcription, Neo4j or Parquet dependency got loaded at import time,
+or if the median import time goes over --max-seconds.
+
+    python benchmarks/bench_import.py --runs 5 --max-seconds 3
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ['whisper', 'torch', 'numpy', 'soundfile', 'imageio_ffmpeg', 'neo4j', 'pyarrow']
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {benchmarks!r})
+from common import load_scraper
+load_scraper([1])
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def run_once():
+    code = CHILD.format(benchmarks=os.path.dirname(os.path.abspath(__file__)), heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=3.0,
+                        help='fail if the median import takes longer than this')
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    seconds = [run['seconds'] for run in runs]
+    loaded = sorted({module for run in runs for module in run['loaded']})
+    # ru_maxrss is the largest child so far: kilobytes on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+    print(f"import time: median {statistics.median(seconds):.3f}s, "
+          f"min {min(seconds):.3f}s, max {max(seconds):.3f}s over {args.runs} runs")
+    print(f"peak RSS: {peak_rss_mb:.1f} MB")
+    print(f"heavy modules loaded at import: {', '.join(loaded) if loaded else 'none'}")
+
+    failed = False
+    if loaded:
+        print("FAIL: heavy dependencies must only be imported where they are used")
+        failed = True
+    if statistics.median(seconds) > args.max_seconds:
+        print(f"FAIL: median import time is over {args.max_seconds}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Event loop lag while scraping, with SQLite on the loop vs on the database thread.
+
+Scrapes several synthetic channels at once and samples how late the event
+loop wakes up from short sleeps. "before" runs every database call inline on
+the loop thread like the old code did, "after" uses the dedicated database
+thread. --media-every N adds a document to every Nth message; the fake
+client writes those files on the loop itself, so expect noisier numbers.
+
+    python benchmarks/bench_loop_lag.py --channels 4 --messages 20000
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import load_scraper
+from fake_telegram import FakeClient, synthetic_channel
+
+
+class InlineDatabase:
+    """Runs database work directly on the calling thread"""
+
+    async def run(self, func, *args):
+        return func(*args)
+
+    def call(self, func, *args):
+        return func(*args)
+
+    def submit(self, func, *args):
+        return func(*args)
+
+
+def run(scraper, database, channel_ids, args):
+    scraper.db_thread = database
+    scraper.media_store = None
+    scraper.pool = scraper.SessionPool({scraper.PRIMARY_SESSION: FakeClient(
+        [synthetic_channel(channel_id, args.messages, media_every=args.media_every, media_size=args.media_size)
+         for channel_id in channel_ids],
+        latency=args.latency)})
+    for channel_id in channel_ids:
+        scraper.state['channels'][str(channel_id)] = 0
+        shutil.rmtree(os.path.join(os.getcwd(), str(channel_id)), ignore_errors=True)
+    shutil.rmtree(os.path.join(os.getcwd(), scraper.MEDIA_STORE_DIR), ignore_errors=True)
+
+    async def scrape_all():
+        monitor = scraper.LoopLagMonitor(interval=0.01)
+        monitor.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(scraper.scrape_channel(str(channel_id), 0) for channel_id in channel_ids))
+        elapsed = time.perf_counter() - start
+        await monitor.stop()
+        return elapsed, monitor.stats()
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return asyncio.run(scrape_all())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=20000, help='messages per channel')
+    parser.add_argument('--media-every', type=int, default=0)
+    parser.add_argument('--media-size', type=int, default=256 * 1024)
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds per fake API round trip')
+    args = parser.parse_args()
+
+    channel_ids = [1000000000 + i for i in range(args.channels)]
+    scraper, workdir = load_scraper(channel_ids)
+    scraper.state['scrape_media'] = True
+
+    try:
+        results = [
+            ('before (SQLite on the event loop)', run(scraper, InlineDatabase(), channel_ids, args)),
+            ('after (database thread)', run(scraper, scraper.DatabaseThread(), channel_ids, args)),
+        ]
+    finally:
+        os.chdir(os.path.dirname(workdir))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    total = args.channels * args.messages
+    for name, (elapsed, stats) in results:
+        print(f"{name:36} {total / elapsed:10.0f} msg/s   lag mean {stats['mean'] * 1000:6.2f} ms   "
+              f"p99 {stats['p99'] * 1000:6.2f} ms   max {stats['max'] * 1000:6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
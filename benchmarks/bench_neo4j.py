@@ -0,0 +1,101 @@
+"""Neo4j upload throughput, against the fake driver or a real local server.
+
+Scrapes synthetic channels (with media and transcripts) into their own
+databases, then times upload_to_neo4j for each of them and reports nodes
+per second, transactions, retries and the batch size the upload settled on.
+
+Without --url the fake driver from fake_services.py is used, which sleeps
+--latency seconds per query and can fail every Nth commit with a transient
+error. With --url it talks to a real server through the neo4j package:
+
+    python benchmarks/bench_neo4j.py --channels 2 --messages 20000 --latency 0.002
+    python benchmarks/bench_neo4j.py --url bolt://localhost:7687 --password secret
+
+Point --url at a throwaway database; the upload MERGEs into whatever is there.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_services
+from common import load_scraper
+from fake_telegram import FakeClient, synthetic_channel
+
+
+def add_transcripts(channel_ids):
+    """Give every other downloaded media file a transcript so Transcript nodes are uploaded too"""
+    for channel_id in channel_ids:
+        conn = sqlite3.connect(os.path.join(str(channel_id), f'{channel_id}.db'))
+        with conn:
+            conn.execute("""UPDATE messages SET transcript = 'Synthetic transcript of message ' || message_id
+                            WHERE media_path IS NOT NULL AND message_id % 2 = 0""")
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--messages', type=int, default=20000, help='messages per channel')
+    parser.add_argument('--media-every', type=int, default=10)
+    parser.add_argument('--url', help='bolt URL of a real Neo4j server (default: fake driver)')
+    parser.add_argument('--password', default='neo4j')
+    parser.add_argument('--latency', type=float, default=0.002, help='fake driver seconds per query')
+    parser.add_argument('--fail-every', type=int, default=0, help='fake driver fails every Nth commit')
+    parser.add_argument('--batch-size', type=int, default=None, help='starting batch size')
+    args = parser.parse_args()
+
+    driver = None if args.url else fake_services.install(args.latency, neo4j_fail_every=args.fail_every)
+    channel_ids = [1000000000 + i for i in range(args.channels)]
+    scraper, workdir = load_scraper(channel_ids)
+    scraper.state['scrape_media'] = True
+    scraper.state['neo4j'] = {'url': args.url or 'bolt://fake:7687', 'database': 'neo4j', 'password': args.password}
+    if args.batch_size:
+        scraper.NEO4J_BATCH_SIZE = args.batch_size
+    scraper.pool = scraper.SessionPool({scraper.PRIMARY_SESSION: FakeClient(
+        [synthetic_channel(channel_id, args.messages, media_every=args.media_every, media_size=1024)
+         for channel_id in channel_ids])})
+
+    async def scrape_all():
+        await asyncio.gather(*(scraper.scrape_channel(str(channel_id), 0) for channel_id in channel_ids))
+
+    async def upload_all():
+        for channel_id in channel_ids:
+            await scraper.upload_to_neo4j(channel_id)
+
+    output = io.StringIO()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            asyncio.run(scrape_all())
+        add_transcripts(channel_ids)
+        with contextlib.redirect_stdout(output):
+            start = time.perf_counter()
+            asyncio.run(upload_all())
+            elapsed = time.perf_counter() - start
+    finally:
+        scraper.checkpoints.flush()
+        os.chdir(os.path.dirname(workdir))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    nodes = scraper.metrics.to_dict()['telegram_scraper_neo4j_rows_uploaded_total']['samples']
+    total = sum(sample['value'] for sample in nodes)
+    counts = ', '.join(f"{int(sample['value'])} {sample['labels']['kind']}" for sample in nodes)
+    print(f"{args.channels} channels x {args.messages} messages -> {counts}")
+    print(f"upload {elapsed:7.2f}s {total / elapsed:10.0f} nodes/s")
+    if driver:
+        print(f"fake driver: {driver.queries} queries, {driver.transactions} transactions, "
+              f"{driver.failures} simulated failures")
+    for line in output.getvalue().splitlines():
+        if 'uploaded channel' in line or 'Error' in line:
+            print(line.strip())
+
+
+if __name__ == '__main__':
+    main()
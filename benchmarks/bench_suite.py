@@ -0,0 +1,226 @@
+"""End-to-end offline benchmark of every pipeline stage.
+
+Drives the real scrape_channel, rescrape_media, export_data, upload_to_neo4j
+and transcribe_media against synthetic channels served by the fake Telegram
+client, a fake Neo4j driver and a fake Whisper model (see fake_services.py),
+so it runs on any Linux box without a network. Audio extraction is replaced
+by writing silent WAV files, so ffmpeg is not part of the numbers.
+
+For each stage it reports wall time, items/sec, the process's peak RSS so
+far, how far RSS rose above its starting point during the stage (sampled on
+Linux) and the time spent in the instrumented sub-steps taken from the
+scraper's metrics. The export stages count rows written, so their items/sec
+is rows/sec and their RSS rise shows whether the export streams.
+
+    python benchmarks/bench_suite.py --channels 4 --messages 5000 --latency 0.002
+    python benchmarks/bench_suite.py --json results.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_services
+from common import load_scraper
+from fake_telegram import FakeClient, synthetic_channel
+
+# Histograms whose time is broken out per stage, by their name in the metrics registry
+STAGE_TIMINGS = {
+    'api': 'telegram_scraper_api_request_seconds',
+    'db commit': 'telegram_scraper_db_write_batch_seconds',
+    'media download': 'telegram_scraper_media_download_seconds',
+    'neo4j upload': 'telegram_scraper_neo4j_upload_seconds',
+}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+
+class RssSampler:
+    """Samples RSS in a background thread to find the highest point during a stage"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start_mb = current_rss_mb()
+        self.peak_mb = self.start_mb
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        if self.start_mb is not None:
+            self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.done.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    @property
+    def rise_mb(self):
+        return None if self.start_mb is None else self.peak_mb - self.start_mb
+
+
+def histogram_sums(scraper):
+    data = scraper.metrics.to_dict()
+    sums = {}
+    for label, name in STAGE_TIMINGS.items():
+        samples = data.get(name, {}).get('samples', [])
+        sums[label] = sum(sample['sum'] for sample in samples)
+    return sums
+
+
+def count_rows(channel_ids, query):
+    total = 0
+    for channel_id in channel_ids:
+        conn = sqlite3.connect(os.path.join(str(channel_id), f'{channel_id}.db'))
+        total += conn.execute(query).fetchone()[0]
+        conn.close()
+    return total
+
+
+def forget_media(scraper, channel_ids):
+    """Drop downloaded media so rescrape_media has everything to fetch again"""
+    for channel_id in channel_ids:
+        shutil.rmtree(os.path.join(str(channel_id), 'media'), ignore_errors=True)
+        conn = sqlite3.connect(os.path.join(str(channel_id), f'{channel_id}.db'))
+        with conn:
+            conn.execute('UPDATE messages SET media_path = NULL')
+        conn.close()
+    if scraper.media_store is not None:
+        scraper.db_thread.call(scraper.media_store.conn.close)
+        scraper.media_store = None
+    shutil.rmtree(scraper.MEDIA_STORE_DIR, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=5000, help='messages per channel')
+    parser.add_argument('--reply-every', type=int, default=10)
+    parser.add_argument('--media-every', type=int, default=50, help='every Nth message carries a document')
+    parser.add_argument('--photo-every', type=int, default=0, help='every Nth message carries a photo')
+    parser.add_argument('--audio-every', type=int, default=2, help='every Nth document is audio rather than video')
+    parser.add_argument('--media-size', type=int, default=256 * 1024)
+    parser.add_argument('--latency', type=float, default=0.002, help='mean seconds per fake API round trip')
+    parser.add_argument('--latency-jitter', type=float, default=0.5, help='round trips vary by +/- this fraction')
+    parser.add_argument('--bandwidth', type=float, default=None, help='fake download bytes/sec (default instant)')
+    parser.add_argument('--neo4j-latency', type=float, default=0.0, help='seconds per fake Neo4j query')
+    parser.add_argument('--audio-seconds', type=float, default=1.0, help='length of each extracted audio file')
+    parser.add_argument('--realtime-factor', type=float, default=0.01, help='fake Whisper seconds per audio second')
+    parser.add_argument('--stages', default='scrape,rescrape,export,ndjson,neo4j,transcribe',
+                        help='comma separated; parquet is also available when pyarrow is installed')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    driver = fake_services.install(args.neo4j_latency, args.realtime_factor)
+    channel_ids = [1000000000 + i for i in range(args.channels)]
+    scraper, workdir = load_scraper(channel_ids)
+    scraper.state['scrape_media'] = True
+    scraper.state['neo4j'] = {'url': 'bolt://fake:7687', 'database': 'neo4j', 'password': 'benchmark'}
+    scraper.extract_audio = fake_services.fake_extract_audio(args.audio_seconds)
+    scraper.pool = scraper.SessionPool({scraper.PRIMARY_SESSION: FakeClient(
+        [synthetic_channel(channel_id, args.messages, reply_every=args.reply_every,
+                           media_every=args.media_every, media_size=args.media_size,
+                           photo_every=args.photo_every, audio_every=args.audio_every)
+         for channel_id in channel_ids],
+        latency=args.latency, latency_jitter=args.latency_jitter, download_bandwidth=args.bandwidth)})
+    total_messages = args.channels * args.messages
+
+    async def scrape():
+        await asyncio.gather(*(scraper.scrape_channel(str(channel_id), 0) for channel_id in channel_ids))
+        return total_messages, 'msg'
+
+    async def rescrape():
+        forget_media(scraper, channel_ids)
+        missing = count_rows(channel_ids, 'SELECT COUNT(*) FROM messages WHERE media_type IS NOT NULL')
+        for channel_id in channel_ids:
+            await scraper.rescrape_media(channel_id)
+        return missing, 'files'
+
+    async def export(export_format):
+        scraper.state['export_format'] = export_format
+        await scraper.export_data()
+        rows = count_rows(channel_ids, 'SELECT COUNT(*) FROM messages')
+        return rows + count_rows(channel_ids, 'SELECT COUNT(*) FROM comments'), 'rows'
+
+    async def neo4j():
+        rows = driver.rows
+        for channel_id in channel_ids:
+            await scraper.upload_to_neo4j(channel_id)
+        return driver.rows - rows, 'nodes'
+
+    async def transcribe():
+        before = count_rows(channel_ids, "SELECT COUNT(*) FROM messages WHERE transcript IS NOT NULL")
+        for channel_id in channel_ids:
+            await scraper.transcribe_media(channel_id)
+        after = count_rows(channel_ids, "SELECT COUNT(*) FROM messages WHERE transcript IS NOT NULL")
+        return after - before, 'files'
+
+    stages = {'scrape': scrape, 'rescrape': rescrape, 'export': lambda: export('json'),
+              'ndjson': lambda: export('ndjson'), 'parquet': lambda: export('parquet'),
+              'neo4j': neo4j, 'transcribe': transcribe}
+    results = []
+    try:
+        for name in args.stages.split(','):
+            before = histogram_sums(scraper)
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), RssSampler() as rss:
+                start = time.perf_counter()
+                items, unit = asyncio.run(stages[name]())
+                elapsed = time.perf_counter() - start
+            after = histogram_sums(scraper)
+            results.append({
+                'stage': name,
+                'seconds': elapsed,
+                'items': items,
+                'unit': unit,
+                'per_second': items / elapsed if elapsed else 0.0,
+                'peak_rss_mb': peak_rss_mb(),
+                'rss_rise_mb': rss.rise_mb,
+                'timings': {label: after[label] - before[label] for label in after
+                            if after[label] - before[label] > 0}
+            })
+    finally:
+        scraper.checkpoints.flush()
+        os.chdir(os.path.dirname(workdir))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.channels} channels x {args.messages} messages, "
+          f"latency {args.latency * 1000:.1f} ms +/- {args.latency_jitter:.0%}")
+    for result in results:
+        timings = ', '.join(f"{label} {seconds:.2f}s" for label, seconds in result['timings'].items())
+        rise = f" (+{result['rss_rise_mb']:.1f} MB in stage)" if result['rss_rise_mb'] is not None else ''
+        print(f"{result['stage']:11} {result['seconds']:7.2f}s {result['per_second']:10.0f} {result['unit']}/s "
+              f"({result['items']} {result['unit']})  peak RSS {result['peak_rss_mb']:6.1f} MB{rise}"
+              + (f"  [{timings}]" if timings else ''))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
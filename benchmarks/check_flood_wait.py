@@ -0,0 +1,104 @@
+"""Checks that flood waits reach the scraper instead of being slept through by Telethon.
+
+Calls go through the real RateLimitedClient._call and Telethon's own _call,
+with a fake sender in place of the network connection. The sender answers
+the first request with a short FLOOD_WAIT and the retry with a result. The
+script exits non-zero if the client never saw the flood wait, did not
+retry after it, or if a two-account SessionPool kept handing the channel to
+the limited account while the wait was running.
+
+    python benchmarks/check_flood_wait.py --seconds 2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telethon import errors
+from telethon.tl import functions, types
+
+from common import load_scraper
+
+
+class FloodingSender:
+    """Stands in for MTProtoSender, failing the first `floods` requests with FLOOD_WAIT_<seconds>"""
+
+    def __init__(self, seconds, floods=1):
+        self.seconds = seconds
+        self.floods = floods
+        self.sent = []
+
+    def send(self, request, ordered=False):
+        self.sent.append(time.monotonic())
+        future = asyncio.get_running_loop().create_future()
+        if len(self.sent) <= self.floods:
+            future.set_exception(errors.FloodWaitError(request=request, capture=self.seconds))
+        else:
+            future.set_result(types.Config.__new__(types.Config))
+        return future
+
+
+def check(condition, message):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    return condition
+
+
+async def flood_wait_is_retried(scraper, seconds):
+    client = scraper.RateLimitedClient(None, 1, 'check')
+    seen = []
+    client.on_flood_wait = seen.append
+    sender = FloodingSender(seconds)
+    with contextlib.redirect_stdout(io.StringIO()):
+        await client._call(sender, functions.help.GetConfigRequest())
+
+    stats = client.rate_limiter.stats['default']
+    waited = sender.sent[1] - sender.sent[0] if len(sender.sent) > 1 else 0
+    return all([
+        check(client.flood_sleep_threshold == 0, "client is created with flood_sleep_threshold=0"),
+        check(seen == [seconds], f"on_flood_wait called with {seconds}s (got {seen})"),
+        check(stats['flood_waits'] == 1, f"rate limiter counted the flood wait (got {stats['flood_waits']})"),
+        check(len(sender.sent) == 2, f"request retried once after the wait (sent {len(sender.sent)} times)"),
+        check(waited >= seconds - 0.05, f"retry waited out the flood wait ({waited:.2f}s)"),
+    ])
+
+
+async def pool_moves_channel(scraper, seconds):
+    pool = scraper.SessionPool({name: scraper.RateLimitedClient(None, 1, name) for name in ('a', 'b')})
+    channel_id = next(i for i in range(1000000000, 1000001000) if pool.account_for(i) == 'a')
+    sender = FloodingSender(seconds)
+    with contextlib.redirect_stdout(io.StringIO()):
+        call = asyncio.ensure_future(pool.clients['a']._call(sender, functions.help.GetConfigRequest()))
+        await asyncio.sleep(min(0.2, seconds / 4))
+        during = pool.account_for(channel_id)
+        await call
+    after = pool.account_for(channel_id)
+    return all([
+        check(during == 'b', f"channel moved to the other account during the wait (got {during})"),
+        check(after == 'a', f"channel back on its own account after the wait (got {after})"),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=int, default=2, help='flood wait the fake sender asks for')
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        scraper, workdir = load_scraper([])
+    try:
+        passed = asyncio.run(flood_wait_is_retried(scraper, args.seconds))
+        passed = asyncio.run(pool_moves_channel(scraper, args.seconds)) and passed
+    finally:
+        os.chdir(os.path.dirname(workdir))
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""Helpers for loading telegram-scraper.py into a throwaway working directory"""
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'telegram-scraper.py')
+
+
+def load_scraper(channels, extra_channels=0):
+    """Import the scraper inside a temp directory with a pre-filled state.json.
+
+    `extra_channels` pads channel_details so state.json is as large as a real
+    install that follows many channels.
+    """
+    workdir = tempfile.mkdtemp(prefix='tg-bench-')
+    os.chdir(workdir)
+    state = {
+        'api_id': 1,
+        'api_hash': 'benchmark',
+        'phone': '+10000000000',
+        'channels': {str(channel_id): 0 for channel_id in channels},
+        'channel_details': {str(i): {'title': f'Padding channel {i}', 'username': None}
+                            for i in range(extra_channels)},
+        'scrape_media': False,
+        'neo4j': {'url': None, 'database': None, 'password': None},
+        'whisper_model': 'base'
+    }
+    with open('state.json', 'w') as f:
+        json.dump(state, f)
+
+    spec = importlib.util.spec_from_file_location('telegram_scraper', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['telegram_scraper'] = module
+    spec.loader.exec_module(module)
+    return module, workdir
@@ -0,0 +1,154 @@
+"""Stand-ins for the Neo4j driver, Whisper and ffmpeg audio extraction.
+
+install() registers fake `neo4j` and `whisper` modules so the scraper's lazy
+imports pick them up, which lets upload_to_neo4j and transcribe_media run
+without a database server or a speech model. Both fakes sleep to simulate
+their cost: a fixed latency per Neo4j query and a real-time factor for
+transcription. The fake driver can also fail every Nth transaction commit
+with a TransientError to exercise the upload's retries.
+"""
+import sys
+import time
+import types
+import wave
+
+
+class FakeResult:
+    def __init__(self, records=None):
+        self.records = records or []
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def consume(self):
+        return self
+
+
+class TransientError(Exception):
+    pass
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+class SessionExpired(Exception):
+    pass
+
+
+class FakeTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+        self.rows = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.closed:
+            self.rollback()
+
+    def run(self, query, parameters=None, **kwargs):
+        self.rows += len(kwargs.get('rows', ()))
+        return self.driver.run_query()
+
+    def commit(self):
+        self.closed = True
+        self.driver.transactions += 1
+        if self.driver.fail_every and self.driver.transactions % self.driver.fail_every == 0:
+            self.driver.failures += 1
+            raise TransientError('Simulated deadlock')
+        self.driver.rows += self.rows
+
+    def rollback(self):
+        self.closed = True
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def run(self, query, parameters=None, **kwargs):
+        return self.driver.run_query()
+
+    def begin_transaction(self):
+        return FakeTransaction(self.driver)
+
+    def close(self):
+        pass
+
+
+class FakeDriver:
+    """Counts queries and sleeps `latency` seconds per query like a round trip to the server.
+
+    `rows` counts the UNWIND rows of committed transactions; with `fail_every`
+    set, every Nth commit raises TransientError instead.
+    """
+
+    def __init__(self, latency=0.0, fail_every=0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.queries = 0
+        self.transactions = 0
+        self.failures = 0
+        self.rows = 0
+
+    def run_query(self):
+        if self.latency:
+            time.sleep(self.latency)
+        self.queries += 1
+        return FakeResult()
+
+    def session(self, **kwargs):
+        return FakeSession(self)
+
+    def close(self):
+        pass
+
+
+class FakeWhisperModel:
+    def __init__(self, realtime_factor):
+        self.realtime_factor = realtime_factor
+
+    def transcribe(self, audio, fp16=False):
+        time.sleep(len(audio) / 16000 * self.realtime_factor)
+        return {'text': f"Synthetic transcript of {len(audio) / 16000:.1f} seconds of audio"}
+
+
+def fake_extract_audio(seconds):
+    """Replacement for extract_audio that writes `seconds` of silent 16 kHz mono WAV"""
+    def extract_audio(video_path, output_path):
+        with wave.open(output_path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(b'\0\0' * int(seconds * 16000))
+        return output_path
+    return extract_audio
+
+
+def install(neo4j_latency=0.0, realtime_factor=0.05, neo4j_fail_every=0):
+    """Register the fake neo4j and whisper modules and return the shared fake driver"""
+    driver = FakeDriver(neo4j_latency, neo4j_fail_every)
+
+    neo4j = types.ModuleType('neo4j')
+    neo4j.GraphDatabase = types.SimpleNamespace(driver=lambda url, auth=None, **kwargs: driver)
+    neo4j.exceptions = types.ModuleType('neo4j.exceptions')
+    neo4j.exceptions.TransientError = TransientError
+    neo4j.exceptions.ServiceUnavailable = ServiceUnavailable
+    neo4j.exceptions.SessionExpired = SessionExpired
+    sys.modules['neo4j'] = neo4j
+    sys.modules['neo4j.exceptions'] = neo4j.exceptions
+
+    whisper = types.ModuleType('whisper')
+    whisper.load_model = lambda name: FakeWhisperModel(realtime_factor)
+    whisper.pad_or_trim = lambda audio: audio
+    sys.modules['whisper'] = whisper
+    return driver
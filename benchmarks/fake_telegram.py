@@ -0,0 +1,186 @@
+"""In-memory stand-ins for the Telethon objects the scraper uses.
+
+Only the attributes and client methods that telegram-scraper.py touches are
+implemented, so the real scraping code can be driven without a network.
+"""
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+from telethon.tl.types import DocumentAttributeFilename, MessageMediaPhoto
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.first_name = f"User{user_id}"
+        self.last_name = None
+        self.username = f"user{user_id}"
+
+
+class FakeReply:
+    def __init__(self, reply_to_msg_id):
+        self.reply_to_msg_id = reply_to_msg_id
+
+
+class FakeMessage:
+    def __init__(self, message_id, date, text, sender=None, reply_to_msg_id=None, media=None):
+        self.id = message_id
+        self.date = date
+        self.message = text
+        self.sender = sender
+        self.sender_id = sender.id if sender else None
+        self.reply_to = FakeReply(reply_to_msg_id) if reply_to_msg_id else None
+        self.reply_to_msg_id = reply_to_msg_id
+        self.media = media
+        self.client = None
+
+    async def get_sender(self):
+        return self.sender
+
+
+class FakeDocument:
+    def __init__(self, document_id, size, mime_type='video/mp4'):
+        self.id = document_id
+        self.size = size
+        self.mime_type = mime_type
+        # Real documents always carry attributes; the file name one is the most common
+        extension = '.ogg' if mime_type.startswith('audio/') else '.mp4'
+        self.attributes = [DocumentAttributeFilename(file_name=f"{document_id}{extension}")]
+
+
+class FakeMediaDocument:
+    """Looks like MessageMediaDocument to the scraper"""
+
+    def __init__(self, document):
+        self.document = document
+
+
+class FakePhoto:
+    def __init__(self, photo_id, size):
+        self.id = photo_id
+        self.size = size
+
+
+class FakeMediaPhoto(MessageMediaPhoto):
+    """Passes the scraper's isinstance checks for photos"""
+
+    def __init__(self, photo):
+        self.photo = photo
+
+
+class FakeChannel:
+    def __init__(self, channel_id, title, messages):
+        self.id = channel_id
+        self.title = title
+        self.username = None
+        self.messages = messages
+
+
+def synthetic_channel(channel_id, size, senders=50, reply_every=10, media_every=0, media_size=64 * 1024,
+                      photo_every=0, photo_size=128 * 1024, audio_every=0):
+    """Build a channel of `size` messages.
+
+    Every `reply_every`th message is a reply, every `media_every`th carries a
+    video document of `media_size` bytes and every `photo_every`th a photo.
+    Every `audio_every`th document is audio/ogg instead of video/mp4.
+    """
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    users = [FakeUser(1000 + i) for i in range(senders)]
+    messages = []
+    for i in range(1, size + 1):
+        reply_to = i - 1 if reply_every and i > 1 and i % reply_every == 0 else None
+        media = None
+        if photo_every and i % photo_every == 0:
+            media = FakeMediaPhoto(FakePhoto(channel_id * 10 ** 7 + i, photo_size))
+        elif media_every and i % media_every == 0:
+            mime_type = 'audio/ogg' if audio_every and (i // media_every) % audio_every == 0 else 'video/mp4'
+            media = FakeMediaDocument(FakeDocument(channel_id * 10 ** 7 + i, media_size, mime_type))
+        messages.append(FakeMessage(i, start + timedelta(seconds=i), f"Synthetic message {i}",
+                                    sender=users[i % senders], reply_to_msg_id=reply_to, media=media))
+    return FakeChannel(channel_id, f"Synthetic {channel_id}", messages)
+
+
+class FakeClient:
+    """Stands in for one account's TelegramClient, serving a set of synthetic channels"""
+
+    def __init__(self, channels, latency=0.0, download_bandwidth=None, latency_jitter=0.0, seed=0):
+        """latency is the mean seconds per API round trip; with latency_jitter each
+        round trip takes latency * (1 +/- latency_jitter), drawn uniformly"""
+        self.channels = {channel.id: channel for channel in channels}
+        # Like Telethon messages, each message knows the client that fetched it
+        for channel in channels:
+            for message in channel.messages:
+                message.client = self
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.random = random.Random(seed)
+        self.download_bandwidth = download_bandwidth  # bytes/sec, None for instant
+
+    async def _round_trip(self):
+        if self.latency_jitter:
+            await asyncio.sleep(self.latency * self.random.uniform(1 - self.latency_jitter, 1 + self.latency_jitter))
+        else:
+            await asyncio.sleep(self.latency)
+
+    def _channel(self, entity):
+        channel_id = getattr(entity, 'channel_id', None) or getattr(entity, 'id', entity)
+        channel_id = int(str(channel_id).replace('-100', '', 1))
+        if channel_id not in self.channels:
+            raise ValueError(f"Unknown channel {entity}")
+        return self.channels[channel_id]
+
+    async def get_entity(self, entity):
+        await self._round_trip()
+        return self._channel(entity)
+
+    async def get_messages(self, entity, limit=None, ids=None):
+        await self._round_trip()
+        messages = self._channel(entity).messages
+        if ids is not None:
+            by_id = {message.id: message for message in messages}
+            if isinstance(ids, list):
+                return [by_id.get(message_id) for message_id in ids]
+            return by_id.get(ids)
+        return list(reversed(messages[-limit:])) if limit else list(reversed(messages))
+
+    async def iter_messages(self, entity, offset_id=0, reverse=False, max_id=0, page_size=100):
+        messages = self._channel(entity).messages
+        if reverse:
+            selected = [message for message in messages if message.id > offset_id]
+        else:
+            selected = [message for message in reversed(messages)
+                        if not offset_id or message.id < offset_id]
+        if max_id:
+            selected = [message for message in selected if message.id < max_id]
+        for index, message in enumerate(selected):
+            if index % page_size == 0:
+                await self._round_trip()
+            yield message
+
+    async def download_media(self, message, file=None):
+        if isinstance(message.media, FakeMediaPhoto):
+            size, extension = message.media.photo.size, '.jpg'
+        else:
+            size, extension = message.media.document.size, '.mp4'
+        await self._round_trip()
+        if self.download_bandwidth:
+            await asyncio.sleep(size / self.download_bandwidth)
+        path = os.path.join(file, f"{message.id}{extension}")
+        with open(path, 'wb') as f:
+            f.write(b'\0' * size)
+        return path
+
+    async def iter_download(self, document, offset=0, request_size=512 * 1024, file_size=None):
+        await self._round_trip()
+        while offset < document.size:
+            chunk = min(request_size, document.size - offset)
+            if self.download_bandwidth:
+                await asyncio.sleep(chunk / self.download_bandwidth)
+            offset += chunk
+            yield b'\0' * chunk
+
+    async def iter_dialogs(self):
+        return
+        yield
@@ -2,17 +2,34 @@ import os
 import sys
 import json
 import csv
+import io
+import atexit
 import sqlite3
 import asyncio
-import whisper
-import logging
-import numpy as np
+import time
+import shutil
+import bisect
+import hashlib
+import functools
+import threading
+import contextlib
+import multiprocessing
 from datetime import datetime
-from telethon import TelegramClient, events
-from telethon.tl.types import PeerChannel, MessageMediaDocument, MessageMediaPhoto
-import imageio_ffmpeg
-import soundfile as sf
-from neo4j import GraphDatabase
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telethon import TelegramClient, events, utils, errors
+from telethon.tl.types import (PeerChannel, MessageMediaPhoto, DocumentAttributeFilename,
+                               Channel, ChatPhotoEmpty)
+# whisper (and torch with it), numpy, soundfile, imageio_ffmpeg and neo4j are imported
+# inside the functions that use them, so scraping starts without loading them
+
+# Parallel exports run in spawned worker processes, which import this file again
+# as __mp_main__. They only need the export functions, so the interactive setup
+# below is skipped there. A frozen (PyInstaller) build instead starts the worker
+# as __main__ with --multiprocessing-fork on its command line, and only hands it
+# to freeze_support() at the bottom of the file, after this setup has run.
+IN_WORKER_PROCESS = __name__ == '__mp_main__' or '--multiprocessing-fork' in sys.argv
 
 def display_ascii_art():
     WHITE = "\033[97m"
@@ -29,9 +46,12 @@ ___________________  _________
     
     print(WHITE + art + RESET)
 
-display_ascii_art()
+if not IN_WORKER_PROCESS:
+    display_ascii_art()
 
 STATE_FILE = 'state.json'
+SCRAPE_CONCURRENCY = 4  # Default number of channels scraped at once
+MEDIA_WORKERS = 4  # Default number of concurrent media downloads
 
 def load_state():
     """Load state from file or create new state"""
@@ -51,7 +71,19 @@ def load_state():
                 'database': None,
                 'password': None
             },
-            'whisper_model': 'base'  # Default whisper model
+            'whisper_model': 'base',  # Default whisper model
+            'scrape_concurrency': SCRAPE_CONCURRENCY,
+            'realtime_updates': True,
+            'poll_schedule': {},
+            'media_workers': MEDIA_WORKERS,
+            'verify_media_hash': False,
+            'backfills': {},
+            'accounts': [],
+            'metrics': {'port': None, 'json_file': None},
+            'tracing': {'enabled': False, 'profile': False},
+            'export_format': 'json',
+            'exports': {},
+            'parallel_export': False
         }
         save_state(state)
     
@@ -74,6 +106,30 @@ def load_state():
             'database': None,
             'password': None
         }
+    if 'scrape_concurrency' not in state:
+        state['scrape_concurrency'] = SCRAPE_CONCURRENCY
+    if 'realtime_updates' not in state:
+        state['realtime_updates'] = True
+    if 'poll_schedule' not in state:
+        state['poll_schedule'] = {}
+    if 'media_workers' not in state:
+        state['media_workers'] = MEDIA_WORKERS
+    if 'verify_media_hash' not in state:
+        state['verify_media_hash'] = False
+    if 'backfills' not in state:
+        state['backfills'] = {}
+    if 'accounts' not in state:
+        state['accounts'] = []
+    if 'metrics' not in state:
+        state['metrics'] = {'port': None, 'json_file': None}
+    if 'tracing' not in state:
+        state['tracing'] = {'enabled': False, 'profile': False}
+    if 'export_format' not in state:
+        state['export_format'] = 'json'
+    if 'exports' not in state:
+        state['exports'] = {}
+    if 'parallel_export' not in state:
+        state['parallel_export'] = False
     if 'whisper_model' not in state:
         state['whisper_model'] = 'base'
         save_state(state)
@@ -81,8 +137,13 @@ def load_state():
     return state
 
 def save_state(state):
-    with open(STATE_FILE, 'w') as f:
+    """Write state atomically so a crash mid-write can't corrupt STATE_FILE"""
+    tmp_file = STATE_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
         json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, STATE_FILE)
 
 def reset_state():
     """Reset state to default values"""
@@ -98,50 +159,808 @@ def reset_state():
             'database': None,
             'password': None
         },
-        'whisper_model': 'base'
+        'whisper_model': 'base',
+        'scrape_concurrency': SCRAPE_CONCURRENCY,
+        'realtime_updates': True,
+        'poll_schedule': {},
+        'media_workers': MEDIA_WORKERS,
+        'verify_media_hash': False,
+        'backfills': {},
+        'accounts': [],
+        'metrics': {'port': None, 'json_file': None},
+        'tracing': {'enabled': False, 'profile': False},
+        'export_format': 'json',
+        'exports': {},
+        'parallel_export': False
     }
     save_state(state)
     return state
 
-state = load_state()
+CHECKPOINT_EVERY = 1000  # messages
+CHECKPOINT_INTERVAL = 10  # seconds
+
+class CheckpointStore:
+    """Coalesces resume offset updates into occasional state writes.
+
+    Offsets are updated in memory straight away but state.json is only
+    rewritten once `every` messages have been checkpointed or `interval`
+    seconds have passed, and always on flush() at shutdown.
+    """
+    
+    def __init__(self, every=CHECKPOINT_EVERY, interval=CHECKPOINT_INTERVAL):
+        self.every = every
+        self.interval = interval
+        self.unsaved = 0
+        self.last_flush = time.monotonic()
+    
+    def advance(self, channel_id, message_id, count=1):
+        """Move a channel's offset forward to message_id; offsets never go back"""
+        channel_id = str(channel_id)
+        if channel_id not in state['channels'] or message_id <= state['channels'][channel_id]:
+            return
+        state['channels'][channel_id] = message_id
+        self.changed(count)
+    
+    def changed(self, count=1):
+        """Record an in-memory state change and save if a checkpoint is due"""
+        self.unsaved += count
+        if self.unsaved >= self.every or time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+    
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.unsaved:
+            return
+        save_state(state)
+        self.unsaved = 0
+
+# Worker processes never read or write state.json; what they need is passed in
+state = load_state() if not IN_WORKER_PROCESS else {}
+checkpoints = CheckpointStore()
+atexit.register(checkpoints.flush)
 
 # Reset state if it's missing required keys
 required_keys = {'api_id', 'api_hash', 'phone', 'channels', 'channel_details', 
                 'scrape_media', 'neo4j', 'whisper_model'}
-if not all(key in state for key in required_keys):
+if not IN_WORKER_PROCESS and not all(key in state for key in required_keys):
     print("Initializing state with default values...")
     state = reset_state()
 
-if not state['api_id'] or not state['api_hash'] or not state['phone']:
+if not IN_WORKER_PROCESS and (not state['api_id'] or not state['api_hash'] or not state['phone']):
     state['api_id'] = int(input("Enter your API ID: "))
     state['api_hash'] = input("Enter your API Hash: ")
     state['phone'] = input("Enter your phone number: ")
     save_state(state)
 
-client = TelegramClient('session', state['api_id'], state['api_hash'])
+METRICS_PREFIX = 'telegram_scraper_'
+METRICS_DUMP_INTERVAL = 15  # seconds between writes of the JSON metrics file
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
 
-async def save_message_to_db(message, channel_id, media_path=None):
-    """Save message and its comments to the database"""
-    # Create channel directory if it doesn't exist
-    channel_dir = os.path.join(os.getcwd(), str(channel_id))
-    os.makedirs(channel_dir, exist_ok=True)
+class Metric:
+    """A counter, gauge or histogram with one series per label combination"""
     
-    conn = sqlite3.connect(os.path.join(channel_dir, f'{channel_id}.db'))
-    c = conn.cursor()
+    def __init__(self, registry, name, help_text, kind, buckets=None):
+        self.registry = registry
+        self.name = METRICS_PREFIX + name
+        self.help_text = help_text
+        self.kind = kind
+        self.buckets = buckets
+        self.series = {}
     
-    # Create messages table if not exists
-    c.execute(f'''CREATE TABLE IF NOT EXISTS messages
-                  (id INTEGER PRIMARY KEY, message_id INTEGER, date TEXT, sender_id INTEGER, 
-                   first_name TEXT, last_name TEXT, username TEXT, message TEXT, 
-                   media_type TEXT, media_path TEXT, mime_type TEXT, reply_to INTEGER, transcript TEXT)''')
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.registry.lock:
+            self.series[key] = self.series.get(key, 0) + value
+    
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.registry.lock:
+            self.series[key] = value
+    
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.registry.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class MetricsRegistry:
+    """Per-stage counters, gauges and histograms for the whole scraper.
+
+    Metrics are updated from the event loop and the database thread, and
+    read by the HTTP endpoint thread, so every access takes the same lock.
+    render() gives the Prometheus text format and to_dict() the JSON dump.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+    
+    def add(self, name, help_text, kind, buckets=None):
+        metric = Metric(self, name, help_text, kind, buckets)
+        self.metrics.append(metric)
+        return metric
+    
+    def counter(self, name, help_text):
+        return self.add(name, help_text, 'counter')
+    
+    def gauge(self, name, help_text):
+        return self.add(name, help_text, 'gauge')
+    
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.add(name, help_text, 'histogram', buckets)
+    
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.help_text}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                for labels, value in metric.series.items():
+                    if metric.kind != 'histogram':
+                        lines.append(f"{metric.name}{format_labels(labels)} {value}")
+                        continue
+                    for bound, count in zip(metric.buckets, value['buckets']):
+                        lines.append(f"{metric.name}_bucket{format_labels(labels, [('le', bound)])} {count}")
+                    lines.append(f"{metric.name}_bucket{format_labels(labels, [('le', '+Inf')])} {value['count']}")
+                    lines.append(f"{metric.name}_sum{format_labels(labels)} {value['sum']}")
+                    lines.append(f"{metric.name}_count{format_labels(labels)} {value['count']}")
+        return '\n'.join(lines) + '\n'
+    
+    def to_dict(self):
+        with self.lock:
+            result = {}
+            for metric in self.metrics:
+                samples = []
+                for labels, value in metric.series.items():
+                    if metric.kind == 'histogram':
+                        samples.append({'labels': dict(labels), 'count': value['count'], 'sum': value['sum'],
+                                        'buckets': dict(zip(map(str, metric.buckets), value['buckets']))})
+                    else:
+                        samples.append({'labels': dict(labels), 'value': value})
+                result[metric.name] = {'type': metric.kind, 'help': metric.help_text, 'samples': samples}
+            return result
+    
+    def dump(self, path):
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'time': time.time(), 'metrics': self.to_dict()}, f, indent=2)
+        os.replace(tmp_file, path)
+
+metrics = MetricsRegistry()
+API_REQUEST_SECONDS = metrics.histogram('api_request_seconds', 'Telegram API request latency by request type')
+API_THROTTLE_SECONDS = metrics.counter('api_throttle_seconds_total', 'Time spent waiting on the rate limiter')
+API_FLOOD_WAITS = metrics.counter('api_flood_waits_total', 'Flood waits returned by Telegram')
+MESSAGES_SCRAPED = metrics.counter('messages_scraped_total', 'Messages written to the channel databases')
+CHANNEL_OFFSET = metrics.gauge('channel_offset', 'Last committed message id per channel')
+CHANNEL_LAST_SCRAPE = metrics.gauge('channel_last_scrape_timestamp_seconds',
+                                    'Unix time a scrape of the channel last finished without error')
+DB_BATCH_SECONDS = metrics.histogram('db_write_batch_seconds', 'Time to write and commit one batch')
+DB_BATCH_ROWS = metrics.counter('db_rows_written_total', 'Rows written by batch commits')
+MEDIA_BYTES = metrics.counter('media_bytes_total', 'Bytes of media downloaded from Telegram')
+MEDIA_DOWNLOAD_SECONDS = metrics.histogram('media_download_seconds', 'Time to download one media file')
+MEDIA_FILES = metrics.counter('media_files_total', 'Media files saved, by how they were obtained')
+MEDIA_QUEUE_DEPTH = metrics.gauge('media_queue_depth', 'Media downloads waiting for a worker')
+SCRAPES_RUNNING = metrics.gauge('scrapes_running', 'Channels being scraped right now')
+LOOP_LAG_SECONDS = metrics.histogram('event_loop_lag_seconds', 'How late the event loop woke from a short sleep')
+TRANSCRIPTION_RTF = metrics.histogram('transcription_realtime_factor',
+                                      'Transcription time divided by audio duration',
+                                      buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10))
+NEO4J_ROWS = metrics.counter('neo4j_rows_uploaded_total', 'Nodes uploaded to Neo4j by type')
+NEO4J_UPLOAD_SECONDS = metrics.histogram('neo4j_upload_seconds', 'Time to upload one channel to Neo4j',
+                                         buckets=(1, 5, 15, 60, 300, 900, 3600))
+NEO4J_BATCH_SECONDS = metrics.histogram('neo4j_batch_seconds', 'Time to write and commit one Neo4j batch')
+NEO4J_RETRIES_TOTAL = metrics.counter('neo4j_batch_retries_total', 'Neo4j batches retried after a transient error')
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path in ('/', '/metrics'):
+            body = metrics.render().encode()
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif path == '/metrics.json':
+            body = json.dumps(metrics.to_dict()).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would otherwise flood the menu
+        pass
+
+metrics_server = None
+metrics_dumper = None
+
+def dump_metrics_file():
+    path = state['metrics']['json_file']
+    if not path:
+        return
+    try:
+        metrics.dump(path)
+    except OSError as e:
+        print(f"\nCould not write metrics to {path}: {e}")
+
+def dump_metrics_periodically(interval):
+    while True:
+        time.sleep(interval)
+        dump_metrics_file()
+
+def start_metrics():
+    """Start the metrics endpoint and JSON dump configured in state, if not already running"""
+    global metrics_server, metrics_dumper
+    port = state['metrics']['port']
+    if port and metrics_server is None:
+        try:
+            metrics_server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+        except OSError as e:
+            print(f"Could not start metrics endpoint on port {port}: {e}")
+        else:
+            threading.Thread(target=metrics_server.serve_forever, daemon=True).start()
+            print(f"Metrics available at http://127.0.0.1:{port}/metrics")
+    if state['metrics']['json_file'] and metrics_dumper is None:
+        metrics_dumper = threading.Thread(target=dump_metrics_periodically,
+                                          args=(METRICS_DUMP_INTERVAL,), daemon=True)
+        metrics_dumper.start()
+        atexit.register(dump_metrics_file)
+
+def stop_metrics():
+    global metrics_server
+    if metrics_server is not None:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+        metrics_server = None
+
+TRACE_DIR = 'traces'
+TRACE_FLUSH_EVENTS = 1000  # spans buffered before they are appended to the trace file
+PROFILE_TOP_FUNCTIONS = 20
+
+class Span:
+    """A traced stage; attributes can be added with set() while it runs"""
+    __slots__ = ('tracer', 'name', 'args', 'start')
+    
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.start, time.perf_counter(), self.args)
+        return False
+    
+    def set(self, **args):
+        self.args.update(args)
+
+class NullSpan:
+    """What span() hands out while tracing is off, so a disabled span costs one call"""
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+    
+    def set(self, **args):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Tracer:
+    """Opt-in spans written to a Chrome trace event file.
+
+    Each asyncio task and thread gets its own track, so concurrent scrapes
+    and the database thread show up side by side. Spans are appended to
+    traces/trace-<time>.json as they finish; open it in chrome://tracing or
+    https://ui.perfetto.dev. With profiling on, cProfile also runs on the
+    event loop thread for the whole run and is saved next to the trace.
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.events = []
+        self.tracks = {}
+        self.file = None
+        self.path = None
+        self.origin = time.perf_counter()
+        self.profiler = None
+        self.profile_path = None
+    
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+    
+    def track(self):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = id(task) if task is not None else threading.get_ident()
+        track = self.tracks.get(key)
+        if track is None:
+            track = self.tracks[key] = len(self.tracks) + 1
+            label = task.get_name() if task is not None else threading.current_thread().name
+            self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': track,
+                                'args': {'name': label}})
+        return track
+    
+    def record(self, name, start, end, args):
+        with self.lock:
+            if not self.enabled:
+                return
+            self.events.append({'name': name, 'cat': 'scraper', 'ph': 'X', 'pid': os.getpid(),
+                                'tid': self.track(), 'ts': (start - self.origin) * 1e6,
+                                'dur': (end - start) * 1e6, 'args': args})
+            if len(self.events) >= TRACE_FLUSH_EVENTS:
+                self.flush()
+    
+    def flush(self):
+        # The trace viewers accept an unterminated array, so a crash still leaves a usable file
+        for event in self.events:
+            self.file.write(json.dumps(event) + ',\n')
+        self.file.flush()
+        self.events = []
+    
+    def start(self, profile=False):
+        if self.enabled:
+            return
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.path = os.path.join(TRACE_DIR, f'trace-{stamp}.json')
+        self.file = open(self.path, 'w')
+        self.file.write('[\n')
+        self.tracks = {}
+        self.enabled = True
+        print(f"Tracing to {self.path}")
+        if profile:
+            import cProfile
+            self.profile_path = os.path.join(TRACE_DIR, f'profile-{stamp}.prof')
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+    
+    def stop(self):
+        if self.profiler is not None:
+            import pstats
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            print(f"\nProfile saved to {self.profile_path}; slowest functions by cumulative time:")
+            pstats.Stats(self.profiler).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+            self.profiler = None
+        with self.lock:
+            if not self.enabled:
+                return
+            self.enabled = False
+            self.flush()
+            self.file.write(json.dumps({'name': 'trace_end', 'ph': 'i', 's': 'g', 'pid': os.getpid(),
+                                        'tid': 0, 'ts': (time.perf_counter() - self.origin) * 1e6}) + '\n]\n')
+            self.file.close()
+            self.file = None
+        print(f"Trace saved to {self.path}")
+
+tracer = Tracer()
+atexit.register(tracer.stop)
+
+def start_tracing():
+    if state['tracing']['enabled']:
+        tracer.start(profile=state['tracing']['profile'])
+
+# Sustained requests per second and burst size for each class of API call
+RATE_LIMITS = {
+    'history': (3, 5),      # message history and lookups by id
+    'download': (20, 20),   # upload.GetFile chunks
+    'resolve': (1, 3),      # usernames, entities and dialogs
+    'default': (5, 10)
+}
+RATE_LIMIT_CLASSES = {
+    'GetHistoryRequest': 'history',
+    'GetMessagesRequest': 'history',  # both messages.GetMessages and channels.GetMessages
+    'GetRepliesRequest': 'history',
+    'SearchRequest': 'history',
+    'GetFileRequest': 'download',
+    'GetCdnFileRequest': 'download',
+    'ResolveUsernameRequest': 'resolve',
+    'GetChannelsRequest': 'resolve',
+    'GetFullChannelRequest': 'resolve',
+    'GetUsersRequest': 'resolve',
+    'GetDialogsRequest': 'resolve'
+}
+FLOOD_WAIT_RETRIES = 3
+MAX_FLOOD_WAIT = 15 * 60  # longer flood waits are raised instead of slept through
+
+class TokenBucket:
+    """Allows `rate` calls per second on average with bursts of up to `burst`"""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Take a token, sleeping until one is available. Returns the time waited."""
+        waited = 0
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+class RateLimiter:
+    """Throttles every Telegram API call and holds all of them during a flood wait.
+
+    Each request is counted against the token bucket of its method class.
+    A FloodWaitError on any request pauses every class until it expires,
+    since Telegram tends to hand out more flood waits to an account that
+    keeps calling while it is already limited.
+    """
+    
+    def __init__(self, limits=RATE_LIMITS):
+        self.buckets = {name: TokenBucket(rate, burst) for name, (rate, burst) in limits.items()}
+        self.flood_until = 0
+        self.stats = {name: {'calls': 0, 'throttle_wait': 0.0, 'flood_waits': 0, 'flood_wait': 0.0}
+                      for name in limits}
+    
+    def method_class(self, request):
+        if utils.is_list_like(request):
+            request = request[0]
+        return RATE_LIMIT_CLASSES.get(type(request).__name__, 'default')
+    
+    async def acquire(self, request):
+        name = self.method_class(request)
+        stats = self.stats[name]
+        delay = self.flood_until - time.monotonic()
+        while delay > 0:
+            stats['flood_wait'] += delay
+            await asyncio.sleep(delay)
+            delay = self.flood_until - time.monotonic()
+        waited = await self.buckets[name].acquire()
+        stats['throttle_wait'] += waited
+        stats['calls'] += 1
+        if waited:
+            API_THROTTLE_SECONDS.inc(waited, method_class=name)
+    
+    def flood_wait(self, request, seconds):
+        """Hold every call for `seconds` after Telegram returned a flood wait"""
+        self.stats[self.method_class(request)]['flood_waits'] += 1
+        API_FLOOD_WAITS.inc(method_class=self.method_class(request))
+        self.flood_until = max(self.flood_until, time.monotonic() + seconds)
+
+def print_rate_limit_stats():
+    for account, account_client in pool.clients.items():
+        limiter = getattr(account_client, 'rate_limiter', None)
+        if limiter is None:
+            continue
+        for name, stats in limiter.stats.items():
+            if stats['calls'] or stats['flood_waits']:
+                print(f"API calls ({account}, {name}): {stats['calls']} calls, "
+                      f"{stats['throttle_wait']:.1f}s throttled, {stats['flood_waits']} flood waits, "
+                      f"{stats['flood_wait']:.1f}s waiting on flood waits")
+
+class RateLimitedClient(TelegramClient):
+    """TelegramClient whose API calls all go through the account's rate limiter.
+
+    Every request Telethon makes, including the ones behind iter_messages
+    and file downloads, passes through _call, so throttling there covers
+    all of them. Flood waits are handled here rather than by Telethon so
+    that one flood wait pauses every task on the account, not just the one
+    that hit it, and so the session pool can move channels elsewhere.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        # Telethon sleeps through flood waits up to flood_sleep_threshold itself
+        # (60s by default), which would hide them from us, so always let them raise
+        kwargs.setdefault('flood_sleep_threshold', 0)
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = RateLimiter()
+        self.on_flood_wait = None
+    
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        for attempt in range(FLOOD_WAIT_RETRIES + 1):
+            await self.rate_limiter.acquire(request)
+            started = time.monotonic()
+            first = request[0] if utils.is_list_like(request) else request
+            try:
+                with tracer.span(type(first).__name__, attempt=attempt):
+                    return await super()._call(sender, request, ordered=ordered)
+            except (errors.FloodWaitError, errors.FloodPremiumWaitError) as e:
+                if self.on_flood_wait:
+                    self.on_flood_wait(e.seconds)
+                if attempt == FLOOD_WAIT_RETRIES or e.seconds > MAX_FLOOD_WAIT:
+                    raise
+                print(f"\nTelegram asked us to wait {e.seconds}s, pausing all requests")
+                self.rate_limiter.flood_wait(request, e.seconds)
+            finally:
+                API_REQUEST_SECONDS.observe(time.monotonic() - started, request=type(first).__name__)
+
+PRIMARY_SESSION = 'session'
+ACCOUNT_RING_REPLICAS = 64  # points per account on the consistent hash ring
+
+class SessionPool:
+    """Spreads channels over several Telegram accounts.
+
+    Channels are assigned by consistent hashing, so adding or removing an
+    account only moves the channels that hash next to it. An account that
+    gets flood-limited is skipped until the wait is over and its channels
+    go to the next account on the ring in the meantime.
+    """
+    
+    def __init__(self, clients, phones=None, replicas=ACCOUNT_RING_REPLICAS):
+        self.clients = {}
+        self.phones = phones or {}
+        self.replicas = replicas
+        self.ring = []
+        self.limited_until = {}
+        for name, account_client in clients.items():
+            self.add(name, account_client)
+    
+    @property
+    def primary(self):
+        return next(iter(self.clients.values()))
+    
+    @staticmethod
+    def ring_hash(key):
+        return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+    
+    def add(self, name, account_client, phone=None):
+        self.clients[name] = account_client
+        if phone:
+            self.phones[name] = phone
+        account_client.on_flood_wait = lambda seconds: self.mark_limited(name, seconds)
+        self.ring.extend((self.ring_hash(f"{name}#{i}"), name) for i in range(self.replicas))
+        self.ring.sort()
+    
+    def remove(self, name):
+        self.ring = [point for point in self.ring if point[1] != name]
+        self.limited_until.pop(name, None)
+        self.phones.pop(name, None)
+        return self.clients.pop(name)
+    
+    def mark_limited(self, name, seconds):
+        self.limited_until[name] = max(self.limited_until.get(name, 0), time.monotonic() + seconds)
+    
+    def is_limited(self, name):
+        return self.limited_until.get(name, 0) > time.monotonic()
+    
+    def account_for(self, channel_id):
+        """Account that should handle channel_id right now"""
+        if len(self.clients) == 1:
+            return next(iter(self.clients))
+        start = bisect.bisect(self.ring, (self.ring_hash(str(channel_id)),))
+        owners = []
+        for i in range(len(self.ring)):
+            name = self.ring[(start + i) % len(self.ring)][1]
+            if name in owners:
+                continue
+            if not self.is_limited(name):
+                return name
+            owners.append(name)
+        # Every account is limited, so use whichever is free soonest
+        return min(owners, key=lambda name: self.limited_until[name])
+    
+    def client_for(self, channel_id):
+        return self.clients[self.account_for(channel_id)]
     
-    # Create comments table if not exists
-    c.execute(f'''CREATE TABLE IF NOT EXISTS comments
+    def account_of(self, account_client):
+        for name, candidate in self.clients.items():
+            if candidate is account_client:
+                return name
+        return PRIMARY_SESSION
+    
+    async def start(self):
+        for name, account_client in self.clients.items():
+            phone = self.phones.get(name)
+            if phone:
+                await account_client.start(phone=phone)
+            else:
+                await account_client.start()
+
+def create_client(account):
+    return RateLimitedClient(account['session'], account['api_id'], account['api_hash'])
+
+def build_session_pool(factory=create_client):
+    """Session pool of the main account plus every account in state['accounts']"""
+    accounts = [{'session': PRIMARY_SESSION, 'api_id': state['api_id'],
+                 'api_hash': state['api_hash'], 'phone': state['phone']}] + state['accounts']
+    return SessionPool({account['session']: factory(account) for account in accounts},
+                       phones={account['session']: account['phone'] for account in accounts})
+
+pool = build_session_pool() if not IN_WORKER_PROCESS else None
+
+DB_BATCH_SIZE = 500
+DB_FLUSH_INTERVAL = 5  # seconds
+
+def table_columns(c, table):
+    c.execute(f'PRAGMA table_info({table})')
+    return [column[1] for column in c.fetchall()]
+
+def migration_base_tables(c):
+    """Messages and comments tables, including columns older databases lack"""
+    c.execute('''CREATE TABLE IF NOT EXISTS messages
+                  (id INTEGER PRIMARY KEY, message_id INTEGER, date TEXT, sender_id INTEGER, 
+                   message TEXT, media_type TEXT, media_path TEXT, mime_type TEXT, 
+                   reply_to INTEGER, transcript TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS comments
                   (id INTEGER PRIMARY KEY, comment_id INTEGER, message_id INTEGER, 
-                   date TEXT, sender_id INTEGER, first_name TEXT, last_name TEXT, 
-                   username TEXT, comment_text TEXT,
+                   date TEXT, sender_id INTEGER, comment_text TEXT,
                    FOREIGN KEY(message_id) REFERENCES messages(message_id))''')
     
+    columns = table_columns(c, 'messages')
+    if 'transcript' not in columns:
+        c.execute('ALTER TABLE messages ADD COLUMN transcript TEXT')
+    if 'mime_type' not in columns:
+        c.execute('ALTER TABLE messages ADD COLUMN mime_type TEXT')
+
+def migration_senders(c):
+    """Senders table, seeded from the names older databases stored on every row"""
+    c.execute('''CREATE TABLE IF NOT EXISTS senders
+                  (sender_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, 
+                   username TEXT, updated_at TEXT)''')
+    if 'first_name' in table_columns(c, 'messages'):
+        c.execute('''INSERT OR IGNORE INTO senders (sender_id, first_name, last_name, username, updated_at)
+                     SELECT sender_id, first_name, last_name, username, MAX(date)
+                     FROM messages WHERE sender_id IS NOT NULL GROUP BY sender_id''')
+
+def migration_unique_ids(c):
+    """Drop rows duplicated by re-scrapes and make message/comment ids unique"""
+    # Temporary index so the duplicate lookups below aren't full scans
+    c.execute('CREATE INDEX IF NOT EXISTS tmp_messages_message_id ON messages(message_id)')
+    # Keep the first copy of each message, filling in media and transcripts found on later copies
+    c.execute('''UPDATE messages SET
+                     media_path = COALESCE(media_path,
+                         (SELECT d.media_path FROM messages d
+                          WHERE d.message_id = messages.message_id AND d.media_path IS NOT NULL)),
+                     transcript = COALESCE(transcript,
+                         (SELECT d.transcript FROM messages d
+                          WHERE d.message_id = messages.message_id AND d.transcript IS NOT NULL))
+                 WHERE id IN (SELECT MIN(id) FROM messages GROUP BY message_id HAVING COUNT(*) > 1)''')
+    c.execute('''DELETE FROM messages
+                 WHERE id NOT IN (SELECT MIN(id) FROM messages GROUP BY message_id)''')
+    c.execute('DROP INDEX tmp_messages_message_id')
+    c.execute('''DELETE FROM comments
+                 WHERE id NOT IN (SELECT MIN(id) FROM comments GROUP BY comment_id)''')
+    
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_message_id ON messages(message_id)')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_comments_comment_id ON comments(comment_id)')
+
+def migration_query_indexes(c):
+    """Indexes for the media, transcript and comment lookups"""
+    # rescrape_media: messages with media that hasn't been downloaded
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_missing_media ON messages(message_id)
+                 WHERE media_type IS NOT NULL AND media_path IS NULL''')
+    # transcribe_media: transcript updates by file name
+    c.execute('CREATE INDEX IF NOT EXISTS idx_messages_media_path ON messages(media_path)')
+    # Comments for a message (Neo4j upload)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_comments_message_id ON comments(message_id)')
+
+def migration_transcript_seq(c):
+    """Sequence number bumped on every transcript update, for incremental exports"""
+    if 'transcript_seq' not in table_columns(c, 'messages'):
+        c.execute('ALTER TABLE messages ADD COLUMN transcript_seq INTEGER')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_transcript_seq ON messages(transcript_seq)
+                 WHERE transcript_seq IS NOT NULL''')
+
+def migration_date_indexes(c):
+    """Indexes so exports can read rows in date order without sorting"""
+    c.execute('CREATE INDEX IF NOT EXISTS idx_messages_date ON messages(date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_comments_date ON comments(date)')
+
+def migration_change_seq(c):
+    """Sequence number bumped on every media path, text or transcript update, for incremental exports.
+
+    Takes over from transcript_seq, which only covered transcripts.
+    """
+    for table in ('messages', 'comments'):
+        if 'change_seq' not in table_columns(c, table):
+            c.execute(f'ALTER TABLE {table} ADD COLUMN change_seq INTEGER')
+        c.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_change_seq ON {table}(change_seq)')
+    c.execute('UPDATE messages SET change_seq = transcript_seq WHERE transcript_seq IS NOT NULL')
+
+def next_change_seq(c):
+    """change_seq for an update, which tells incremental exports which rows to send again"""
+    c.execute('''SELECT MAX((SELECT COALESCE(MAX(change_seq), 0) FROM messages),
+                            (SELECT COALESCE(MAX(change_seq), 0) FROM comments)) + 1''')
+    return c.fetchone()[0]
+
+# Applied in order; PRAGMA user_version records how many have run on a database
+MIGRATIONS = [
+    migration_base_tables,
+    migration_senders,
+    migration_unique_ids,
+    migration_query_indexes,
+    migration_transcript_seq,
+    migration_date_indexes,
+    migration_change_seq,
+]
+
+def migrate_db(conn):
+    """Bring a channel database up to the latest schema version"""
+    c = conn.cursor()
+    c.execute('PRAGMA user_version')
+    version = c.fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            migration(c)
+            c.execute(f'PRAGMA user_version = {number}')
+
+SENDER_CACHE_SIZE = 10000
+
+class SenderCache:
+    """Bounded LRU of sender details keyed by sender_id"""
+    
+    def __init__(self, size=SENDER_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+    
+    def get(self, sender_id):
+        info = self.entries.get(sender_id)
+        if info is not None:
+            self.entries.move_to_end(sender_id)
+        return info
+    
+    def put(self, sender_id, info):
+        self.entries[sender_id] = info
+        self.entries.move_to_end(sender_id)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+sender_cache = SenderCache()
+
+async def resolve_sender(message):
+    """Return (first_name, last_name, username) for a message's sender.
+
+    Only senders missing from the LRU are looked at, and only those the
+    message didn't already bring along cost a get_sender() round trip.
+    """
+    if message.sender_id is None:
+        return None
+    info = sender_cache.get(message.sender_id)
+    if info is not None:
+        return info
+    
+    with tracer.span('get_sender', message_id=message.id, sender_id=message.sender_id):
+        sender = message.sender or await message.get_sender()
+    info = (getattr(sender, 'first_name', None),
+            getattr(sender, 'last_name', None),
+            getattr(sender, 'username', None))
+    sender_cache.put(message.sender_id, info)
+    return info
+
+def message_rows(message, media_path=None):
+    """Build the messages row and, for replies, the comments row for a message"""
     # Get MIME type if it's a document
     mime_type = None
     if hasattr(message.media, 'document'):
@@ -151,115 +970,876 @@ async def save_message_to_db(message, channel_id, media_path=None):
             elif hasattr(message.media.document, 'mime_type'):
                 mime_type = message.media.document.mime_type
     
-    # Get sender information safely
-    sender_id = None
-    first_name = None
-    last_name = None
-    username = None
-    
-    if message.sender:
-        sender_id = message.sender_id
-        if hasattr(message.sender, 'first_name'):
-            first_name = message.sender.first_name
-        if hasattr(message.sender, 'last_name'):
-            last_name = message.sender.last_name
-        if hasattr(message.sender, 'username'):
-            username = message.sender.username
-    
-    # Save the message with ISO format date
-    c.execute('''INSERT OR IGNORE INTO messages 
-                 (message_id, date, sender_id, first_name, last_name, username, 
-                  message, media_type, media_path, mime_type, reply_to, transcript)
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-              (message.id, 
-               message.date.isoformat(), 
-               sender_id,
-               first_name,
-               last_name,
-               username,
-               message.message, 
-               message.media.__class__.__name__ if message.media else None, 
-               media_path,
-               mime_type,
-               message.reply_to_msg_id if message.reply_to else None,
-               None))
-    
-    # If this is a comment (reply to another message), save it in comments table
+    # Message row with ISO format date
+    message_row = (message.id, 
+                   message.date.isoformat(), 
+                   message.sender_id,
+                   message.message, 
+                   message.media.__class__.__name__ if message.media else None, 
+                   media_path,
+                   mime_type,
+                   message.reply_to_msg_id if message.reply_to else None,
+                   None)
+    
+    # If this is a comment (reply to another message), it also goes in the comments table
+    comment_row = None
     if message.reply_to:
-        c.execute('''INSERT OR IGNORE INTO comments 
-                     (comment_id, message_id, date, sender_id, first_name, last_name, 
-                      username, comment_text)
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                  (message.id,
-                   message.reply_to_msg_id,
-                   message.date.isoformat(),
-                   sender_id,
-                   first_name,
-                   last_name,
-                   username,
-                   message.message))
+        comment_row = (message.id,
+                       message.reply_to_msg_id,
+                       message.date.isoformat(),
+                       message.sender_id,
+                       message.message)
     
-    conn.commit()
-    conn.close()
+    return message_row, comment_row
+
+class DatabaseThread:
+    """Runs SQLite work on one dedicated thread with an async API.
+
+    Commits and fsyncs then never block the event loop, so downloads and
+    updates keep flowing while the disk catches up. Every connection is
+    opened and used on this one thread, which also keeps writes to a
+    database in the order they were submitted.
+    """
+    
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+    
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+    
+    def call(self, func, *args):
+        """Run func on the database thread from synchronous code and wait for it"""
+        return self.executor.submit(func, *args).result()
+    
+    def submit(self, func, *args):
+        """Queue func on the database thread without waiting, printing any error it raises"""
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(self.report_error)
+        return future
+    
+    @staticmethod
+    def report_error(future):
+        if future.exception():
+            print(f"\nDatabase error: {future.exception()}")
+
+db_thread = DatabaseThread()
+
+class MessageWriter:
+    """Batched writer for a single channel database.
+
+    Holds one connection open for a whole scrape, buffers rows and writes them
+    with executemany once batch_size rows are pending or flush_interval seconds
+    have passed. Batches are committed on the database thread while scraping
+    carries on, with at most one batch in flight. The channel's resume offset
+    in state['channels'] is only advanced after the batch containing that
+    message has been committed.
+    
+    Use it as `async with MessageWriter(channel_id) as writer:`.
+    """
+    
+    def __init__(self, channel_id, batch_size=DB_BATCH_SIZE, flush_interval=DB_FLUSH_INTERVAL):
+        self.channel_id = str(channel_id)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.conn = None
+        
+        self.messages = []
+        self.comments = []
+        self.senders = []
+        self.known_senders = set()
+        self.media_updates = []
+        self.text_updates = []
+        self.pending_offset = None
+        self.shard_progress = {}
+        self.last_flush = time.monotonic()
+        self.writing = None
+        self.flush_lock = asyncio.Lock()
+    
+    async def __aenter__(self):
+        await self.open()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    def connect(self):
+        # Create channel directory if it doesn't exist
+        channel_dir = os.path.join(os.getcwd(), self.channel_id)
+        os.makedirs(channel_dir, exist_ok=True)
+        
+        conn = sqlite3.connect(os.path.join(channel_dir, f'{self.channel_id}.db'))
+        conn.execute('PRAGMA journal_mode=WAL')
+        migrate_db(conn)
+        return conn
+    
+    async def open(self):
+        self.conn = await db_thread.run(self.connect)
+    
+    async def add_message(self, message, media_path=None, sender=None, shard=None):
+        """Queue a message (and its comment row and sender) and flush if the batch is due.
+
+        Messages read in order advance the channel's resume offset once
+        committed. Messages from a backfill shard advance that shard's
+        done_up_to instead, since shards finish out of order.
+        """
+        message_row, comment_row = message_rows(message, media_path)
+        if sender is not None and message.sender_id not in self.known_senders:
+            self.known_senders.add(message.sender_id)
+            self.senders.append((message.sender_id, *sender, message.date.isoformat()))
+        self.messages.append(message_row)
+        if comment_row:
+            self.comments.append(comment_row)
+        if shard is not None:
+            progress = self.shard_progress.get(id(shard))
+            if progress is None or message.id > progress[1]:
+                self.shard_progress[id(shard)] = (shard, message.id)
+        elif self.pending_offset is None or message.id > self.pending_offset:
+            self.pending_offset = message.id
+        await self.maybe_flush()
+    
+    async def update_media_path(self, message_id, media_path):
+        """Queue a media_path update for an already queued or stored message"""
+        self.media_updates.append((media_path, message_id))
+        await self.maybe_flush()
+    
+    async def update_message_text(self, message_id, text):
+        """Queue new text for an edited message and its comment row"""
+        self.text_updates.append((text, message_id))
+        await self.maybe_flush()
+    
+    def pending(self):
+        return (len(self.messages) + len(self.comments) + len(self.senders) +
+                len(self.media_updates) + len(self.text_updates))
+    
+    async def maybe_flush(self):
+        if (self.pending() >= self.batch_size or
+                time.monotonic() - self.last_flush >= self.flush_interval):
+            await self.flush(wait=False)
+    
+    async def flush(self, wait=True):
+        """Send all buffered rows to the database thread as one transaction.
+
+        Waits for the previous batch first so only one is ever in flight.
+        With wait=False the new batch commits in the background.
+        """
+        self.last_flush = time.monotonic()
+        async with self.flush_lock:
+            if self.writing:
+                writing, self.writing = self.writing, None
+                await writing
+            if self.pending():
+                batch = {
+                    'messages': self.messages,
+                    'comments': self.comments,
+                    'senders': self.senders,
+                    'media_updates': self.media_updates,
+                    'text_updates': self.text_updates
+                }
+                self.messages = []
+                self.comments = []
+                self.senders = []
+                self.media_updates = []
+                self.text_updates = []
+                self.writing = asyncio.ensure_future(
+                    self.commit(batch, self.pending_offset, self.shard_progress))
+                self.pending_offset = None
+                self.shard_progress = {}
+            if wait and self.writing:
+                writing, self.writing = self.writing, None
+                await writing
+    
+    def write_batch(self, batch):
+        started = time.monotonic()
+        with tracer.span('write_batch', channel_id=self.channel_id,
+                         rows=sum(len(rows) for rows in batch.values())), self.conn:
+            c = self.conn.cursor()
+            if batch['messages']:
+                c.executemany('''INSERT OR IGNORE INTO messages 
+                                 (message_id, date, sender_id, message, media_type, media_path, 
+                                  mime_type, reply_to, transcript)
+                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', batch['messages'])
+            if batch['comments']:
+                c.executemany('''INSERT OR IGNORE INTO comments 
+                                 (comment_id, message_id, date, sender_id, comment_text)
+                                 VALUES (?, ?, ?, ?, ?)''', batch['comments'])
+            if batch['senders']:
+                c.executemany('''INSERT OR REPLACE INTO senders 
+                                 (sender_id, first_name, last_name, username, updated_at)
+                                 VALUES (?, ?, ?, ?, ?)''', batch['senders'])
+            # Media updates go last so they also apply to messages inserted in this batch
+            if batch['media_updates'] or batch['text_updates']:
+                seq = next_change_seq(c)
+            if batch['media_updates']:
+                c.executemany('''UPDATE messages SET media_path = ?, change_seq = ? WHERE message_id = ?''',
+                              [(media_path, seq, message_id) for media_path, message_id in batch['media_updates']])
+            if batch['text_updates']:
+                text_updates = [(text, seq, message_id) for text, message_id in batch['text_updates']]
+                c.executemany('''UPDATE messages SET message = ?, change_seq = ? WHERE message_id = ?''',
+                              text_updates)
+                c.executemany('''UPDATE comments SET comment_text = ?, change_seq = ? WHERE comment_id = ?''',
+                              text_updates)
+        DB_BATCH_SECONDS.observe(time.monotonic() - started)
+        for table, rows in batch.items():
+            if rows:
+                DB_BATCH_ROWS.inc(len(rows), table=table)
+    
+    async def commit(self, batch, pending_offset, shard_progress):
+        await db_thread.run(self.write_batch, batch)
+        
+        # The batch is committed, so it is now safe to resume after it
+        batch_messages = len(batch['messages'])
+        if batch_messages:
+            MESSAGES_SCRAPED.inc(batch_messages, channel=self.channel_id)
+        if pending_offset is not None:
+            checkpoints.advance(self.channel_id, pending_offset, count=batch_messages)
+            if self.channel_id in state['channels']:
+                CHANNEL_OFFSET.set(state['channels'][self.channel_id], channel=self.channel_id)
+        if shard_progress:
+            for shard, message_id in shard_progress.values():
+                shard['done_up_to'] = max(shard['done_up_to'], message_id)
+            checkpoints.changed(batch_messages)
+    
+    async def close(self):
+        if self.conn is None:
+            return
+        try:
+            await self.flush()
+        finally:
+            await db_thread.run(self.conn.close)
+            self.conn = None
 
 MAX_RETRIES = 5
 
+MEDIA_STORE_DIR = 'media_store'
+
+def media_key(message):
+    """Telegram's own id for a message's file, shared by every forward of it"""
+    if isinstance(message.media, MessageMediaPhoto) and message.media.photo:
+        return f"photo-{message.media.photo.id}"
+    document = getattr(message.media, 'document', None)
+    if document is not None and getattr(document, 'id', None):
+        return f"document-{document.id}"
+    return None
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_or_copy(source, target):
+    """Hardlink source to target, copying when the filesystem can't link"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+class MediaStore:
+    """Content-addressed store for downloaded media, shared by all channels.
+
+    Every file is kept once under media_store/blobs, keyed by its Telegram
+    photo or document id, and hardlinked into each channel's media folder
+    that references it. A forward of an already downloaded file is therefore
+    linked from the store instead of being downloaded again. With
+    state['verify_media_hash'] on, blobs are also checked against the SHA-256
+    recorded when they were stored before being reused.
+    """
+    
+    def __init__(self, root=MEDIA_STORE_DIR):
+        self.root = os.path.join(os.getcwd(), root)
+        self.blob_dir = os.path.join(self.root, 'blobs')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(self.root, 'index.db'))
+        # The index only saves re-downloads, so a commit lost in a crash is harmless
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS blobs
+                             (media_key TEXT PRIMARY KEY, blob TEXT, filename TEXT,
+                              size INTEGER, sha256 TEXT, stored_at TEXT)''')
+        self.conn.commit()
+        # Lets callers on other threads skip the lookup for files that were never stored
+        self.keys = {row[0] for row in self.conn.execute('SELECT media_key FROM blobs')}
+    
+    def lookup(self, key, expected_size=None):
+        """Return (blob path, original filename) for a stored file, or None"""
+        row = self.conn.execute('''SELECT blob, filename, size, sha256 FROM blobs
+                                   WHERE media_key = ?''', (key,)).fetchone()
+        if not row:
+            return None
+        blob, filename, size, sha256 = row
+        blob_path = os.path.join(self.blob_dir, blob)
+        
+        valid = os.path.exists(blob_path) and os.path.getsize(blob_path) == size
+        if valid and expected_size and size != expected_size:
+            valid = False
+        if valid and state['verify_media_hash'] and sha256 and file_sha256(blob_path) != sha256:
+            valid = False
+        if not valid:
+            self.forget(key)
+            return None
+        return blob_path, filename
+    
+    def link_into(self, blob_path, filename, media_dir):
+        """Link a stored blob into a channel media folder and return the file name used"""
+        target = os.path.join(media_dir, filename)
+        if os.path.exists(target):
+            if os.path.samefile(target, blob_path):
+                return filename
+            # A different file already has this name in the channel
+            stem, ext = os.path.splitext(filename)
+            filename = f"{stem}_{os.path.splitext(os.path.basename(blob_path))[0]}{ext}"
+            target = os.path.join(media_dir, filename)
+            if os.path.exists(target):
+                return filename
+        link_or_copy(blob_path, target)
+        return filename
+    
+    def adopt(self, key, path):
+        """Add a freshly downloaded channel file to the store"""
+        filename = os.path.basename(path)
+        blob = key + os.path.splitext(filename)[1]
+        blob_path = os.path.join(self.blob_dir, blob)
+        if os.path.exists(blob_path):
+            os.remove(blob_path)
+        link_or_copy(path, blob_path)
+        
+        sha256 = file_sha256(blob_path) if state['verify_media_hash'] else None
+        with self.conn:
+            self.conn.execute('''INSERT OR REPLACE INTO blobs
+                                 (media_key, blob, filename, size, sha256, stored_at)
+                                 VALUES (?, ?, ?, ?, ?, ?)''',
+                              (key, blob, filename, os.path.getsize(blob_path), sha256,
+                               datetime.now().isoformat()))
+        self.keys.add(key)
+    
+    def forget(self, key):
+        self.keys.discard(key)
+        with self.conn:
+            self.conn.execute('DELETE FROM blobs WHERE media_key = ?', (key,))
+
+DOWNLOAD_CHUNK_SIZE = 512 * 1024  # bytes per request; resume offsets are aligned to this
+DOWNLOAD_CHECKPOINT_BYTES = 8 * 1024 * 1024  # how often the .part offset is persisted
+MAX_RETRY_DELAY = 60  # seconds
+# Download errors worth retrying; anything else (a full disk, media that is gone) fails straight away
+TRANSIENT_DOWNLOAD_ERRORS = (ConnectionError, TimeoutError, asyncio.TimeoutError,
+                             errors.ServerError, errors.TimedOutError, errors.RpcCallFailError)
+
+def document_filename(message, document):
+    """File name a document is saved under, from its attributes if it has one"""
+    for attr in document.attributes:
+        if isinstance(attr, DocumentAttributeFilename) and attr.file_name:
+            return os.path.basename(attr.file_name)
+    return f"{message.id}{utils.get_extension(document)}"
+
+def document_path(message, document, media_dir):
+    """Where a finished document goes, falling back to name_<message id> if the name is taken"""
+    filename = document_filename(message, document)
+    path = os.path.join(media_dir, filename)
+    if os.path.exists(path):
+        # A different file already has this name in the channel
+        stem, ext = os.path.splitext(filename)
+        path = os.path.join(media_dir, f"{stem}_{message.id}{ext}")
+    return path
+
+def save_part_offset(meta_file, document, offset):
+    tmp_file = meta_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'document_id': document.id, 'size': document.size, 'offset': offset}, f)
+    os.replace(tmp_file, meta_file)
+
+async def download_document_resumable(message, media_dir):
+    """Download a document in chunks to a .part file that survives failures.
+
+    The number of bytes safely on disk is kept next to the .part file, and a
+    later attempt (or a later rescrape_media run) continues from there. The
+    .part file is named after the message and document ids, since documents
+    often share a file name, and the final name is only picked once the
+    download is complete.
+    """
+    document = message.media.document
+    path = document_path(message, document, media_dir)
+    if os.path.exists(path) and os.path.getsize(path) == document.size:
+        return path
+    
+    part_file = os.path.join(media_dir, f"{message.id}_{document.id}.part")
+    meta_file = part_file + '.json'
+    offset = 0
+    if os.path.exists(part_file) and os.path.exists(meta_file):
+        try:
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+            if meta.get('document_id') == document.id and meta.get('size') == document.size:
+                offset = min(meta.get('offset', 0), os.path.getsize(part_file))
+        except (ValueError, OSError):
+            offset = 0
+    offset -= offset % DOWNLOAD_CHUNK_SIZE
+    
+    with open(part_file, 'r+b' if offset else 'wb') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        unsaved = 0
+        try:
+            async for chunk in message.client.iter_download(document, offset=offset,
+                                                            request_size=DOWNLOAD_CHUNK_SIZE,
+                                                            file_size=document.size):
+                f.write(chunk)
+                offset += len(chunk)
+                unsaved += len(chunk)
+                if unsaved >= DOWNLOAD_CHECKPOINT_BYTES:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    save_part_offset(meta_file, document, offset)
+                    unsaved = 0
+        finally:
+            # Keep whatever arrived, even if the download failed part way
+            f.flush()
+            os.fsync(f.fileno())
+            save_part_offset(meta_file, document, offset)
+    
+    if offset < document.size:
+        raise IOError(f"Download stopped at {offset} of {document.size} bytes")
+    
+    path = document_path(message, document, media_dir)
+    os.replace(part_file, path)
+    os.remove(meta_file)
+    return path
+
+async def download_with_retries(message, media_dir):
+    """Download a message's media, retrying network errors with exponential backoff up to MAX_RETRIES times.
+
+    An expired file reference is renewed by fetching the message again.
+    """
+    for attempt in range(1, MAX_RETRIES + 1):
+        document = getattr(message.media, 'document', None)
+        resumable = document is not None and getattr(document, 'size', None)
+        try:
+            if resumable:
+                return await download_document_resumable(message, media_dir)
+            return await message.client.download_media(message, file=media_dir)
+        except errors.FileReferenceExpiredError:
+            if attempt == MAX_RETRIES:
+                raise
+            refetched = await message.client.get_messages(message.peer_id, ids=message.id)
+            if not refetched or not refetched.media:
+                raise
+            print(f"\nFile reference for message {message.id} expired, fetched the message again")
+            message = refetched
+        except TRANSIENT_DOWNLOAD_ERRORS as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = min(2 ** attempt, MAX_RETRY_DELAY)
+            print(f"\nDownload of message {message.id} failed ({e}), "
+                  f"retrying in {delay}s (attempt {attempt}/{MAX_RETRIES})")
+            await asyncio.sleep(delay)
+
+media_store = None
+
+def get_media_store():
+    global media_store
+    if media_store is None:
+        media_store = MediaStore()
+    return media_store
+
+def link_from_store(key, expected_size, media_dir):
+    """Link the stored copy of a file into media_dir and return its name, or None if not stored"""
+    store = get_media_store()
+    stored = store.lookup(key, expected_size)
+    if not stored:
+        return None
+    return store.link_into(stored[0], stored[1], media_dir)
+
+def add_to_store(key, path):
+    get_media_store().adopt(key, path)
+
 async def download_media(channel_id, message):
-    """Download media from a message"""
+    """Download media from a message, reusing the shared copy if it was seen before"""
     if not message.media:
         return None
     
+    with tracer.span('download_media', channel_id=str(channel_id), message_id=message.id) as span:
+        try:
+            # Create channel and media directories if they don't exist
+            channel_dir = os.path.join(os.getcwd(), str(channel_id))
+            media_dir = os.path.join(channel_dir, 'media')
+            os.makedirs(media_dir, exist_ok=True)
+            
+            # The store's index and file linking run on the database thread
+            key = media_key(message)
+            if key and (media_store is None or key in media_store.keys):
+                expected_size = getattr(getattr(message.media, 'document', None), 'size', None)
+                filename = await db_thread.run(link_from_store, key, expected_size, media_dir)
+                if filename:
+                    MEDIA_FILES.inc(source='store')
+                    span.set(source='store')
+                    return filename
+            
+            # Download the media
+            started = time.monotonic()
+            path = await download_with_retries(message, media_dir)
+            if path:
+                MEDIA_DOWNLOAD_SECONDS.observe(time.monotonic() - started)
+                MEDIA_BYTES.inc(os.path.getsize(path))
+                MEDIA_FILES.inc(source='telegram')
+                if key:
+                    # Nothing waits on the store, so it is updated in the background
+                    db_thread.submit(add_to_store, key, path)
+                # Return just the filename, not the full path
+                return os.path.basename(path)
+            return None
+        except Exception as e:
+            MEDIA_FILES.inc(source='failed')
+            print(f"Error downloading media: {e}")
+            return None
+
+MEDIA_QUEUE_SIZE = 100  # pending downloads before scraping waits for the workers
+
+class MediaDownloadPipeline:
+    """Downloads media in the background while message ingestion carries on.
+
+    Scrapes push (writer, message) jobs onto a bounded queue and a pool of
+    workers downloads them, writing media_path back through the channel's
+    MessageWriter so the updates are batched with everything else. When the
+    queue is full put() waits, which holds ingestion back instead of letting
+    the backlog grow without limit. A message that is already queued is not
+    queued twice.
+    """
+    
+    def __init__(self, workers=MEDIA_WORKERS, queue_size=MEDIA_QUEUE_SIZE):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.pending = {}
+        self.queued = set()
+        self.abandoned = set()
+        self.downloads = {}
+        self.feeders = {}
+        self.drained = asyncio.Condition()
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(max(1, workers))]
+    
+    async def put(self, writer, message):
+        job = (writer.channel_id, message.id)
+        if job in self.queued:
+            return
+        self.queued.add(job)
+        try:
+            await self.queue.put((writer, message))
+        except BaseException:
+            # Cancelled while the queue was full, so the job never made it in
+            self.queued.discard(job)
+            raise
+        self.pending[writer.channel_id] = self.pending.get(writer.channel_id, 0) + 1
+        MEDIA_QUEUE_DEPTH.set(self.queue.qsize())
+    
+    async def download(self, writer, message):
+        """Run one download as its own task so abandon() can cancel it"""
+        download = asyncio.ensure_future(download_media(writer.channel_id, message))
+        self.downloads[download] = writer
+        try:
+            await asyncio.wait({download})
+        finally:
+            del self.downloads[download]
+            download.cancel()
+        return None if download.cancelled() else download.result()
+    
+    async def worker(self):
+        while True:
+            writer, message = await self.queue.get()
+            MEDIA_QUEUE_DEPTH.set(self.queue.qsize())
+            try:
+                if writer not in self.abandoned:
+                    media_path = await self.download(writer, message)
+                    if media_path:
+                        await writer.update_media_path(message.id, media_path)
+            except Exception as e:
+                print(f"\nError saving media for message {message.id}: {e}")
+            finally:
+                self.queued.discard((writer.channel_id, message.id))
+                self.queue.task_done()
+                async with self.drained:
+                    self.pending[writer.channel_id] -= 1
+                    if not self.pending[writer.channel_id]:
+                        self.abandoned = {w for w in self.abandoned if w.channel_id != writer.channel_id}
+                    self.drained.notify_all()
+    
+    def feed(self, writer, jobs):
+        """Run a coroutine that queues jobs for writer in the background.
+
+        Used for work that may wait a long time on a full queue, like
+        requeue_missing_media, so it doesn't hold up the scrape that started
+        it. drain() waits for it and abandon() cancels it.
+        """
+        feeder = asyncio.ensure_future(jobs)
+        self.feeders[feeder] = writer
+        feeder.add_done_callback(lambda task: self.feeders.pop(task, None))
+    
+    def abandon(self, writer):
+        """Skip a writer's queued downloads and cancel the ones running, e.g. on Ctrl+C.
+
+        Their messages keep a NULL media_path, so requeue_missing_media picks
+        them up on the next run.
+        """
+        self.abandoned.add(writer)
+        for task, owner in list(self.downloads.items()) + list(self.feeders.items()):
+            if owner is writer:
+                task.cancel()
+    
+    async def drain(self, channel_id):
+        """Wait until every queued download for a channel has finished"""
+        feeders = [feeder for feeder, writer in self.feeders.items() if writer.channel_id == str(channel_id)]
+        for result in await asyncio.gather(*feeders, return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f"\nError queueing media downloads: {result}")
+        async with self.drained:
+            await self.drained.wait_for(lambda: not self.pending.get(str(channel_id)))
+
+media_pipeline = None
+
+def get_media_pipeline():
+    """Return the download pipeline for the running event loop, starting it if needed"""
+    global media_pipeline
+    if media_pipeline is None or media_pipeline.loop is not asyncio.get_running_loop():
+        media_pipeline = MediaDownloadPipeline(state['media_workers'])
+    return media_pipeline
+
+RESCRAPE_BATCH_SIZE = 100  # Telegram returns at most 100 messages per get_messages call
+
+def count_missing_media(db_file):
+    conn = sqlite3.connect(db_file)
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*) FROM messages WHERE media_type IS NOT NULL AND media_path IS NULL')
+    count = c.fetchone()[0]
+    conn.close()
+    return count
+
+def missing_media_ids(db_file):
+    conn = sqlite3.connect(db_file)
+    migrate_db(conn)
+    c = conn.cursor()
+    c.execute('SELECT message_id FROM messages WHERE media_type IS NOT NULL AND media_path IS NULL')
+    message_ids = [row[0] for row in c.fetchall()]
+    conn.close()
+    return message_ids
+
+async def queue_media_batch(client, entity, writer, message_ids):
+    """Fetch up to RESCRAPE_BATCH_SIZE messages by id and queue their media for download"""
     try:
-        # Create channel and media directories if they don't exist
-        channel_dir = os.path.join(os.getcwd(), str(channel_id))
-        media_dir = os.path.join(channel_dir, 'media')
-        os.makedirs(media_dir, exist_ok=True)
-        
-        # Download the media
-        path = await client.download_media(message, file=media_dir)
-        if path:
-            # Return just the filename, not the full path
-            return os.path.basename(path)
-        return None
+        messages = await client.get_messages(entity, ids=message_ids)
     except Exception as e:
-        print(f"Error downloading media: {e}")
-        return None
+        print(f"\nError fetching messages {message_ids[0]}-{message_ids[-1]}: {e}")
+        return
+    
+    media = get_media_pipeline()
+    for message_id, message in zip(message_ids, messages):
+        if message is None or not message.media:
+            print(f"\nMessage {message_id} no longer has media, skipping")
+            continue
+        await media.put(writer, message)
+
+media_requeued = set()  # channels whose missing media was queued again this run
+
+async def requeue_missing_media(client, entity, writer):
+    """Queue downloads for stored messages that have no media yet, once per channel per run.
+
+    Messages are committed (and the resume offset moves past them) before
+    their media has downloaded, so after a crash or Ctrl+C those downloads
+    would otherwise never happen. The first scrape of each channel after
+    starting picks them up again, in the background through
+    MediaDownloadPipeline.feed so new messages keep flowing meanwhile.
+    """
+    channel_id = writer.channel_id
+    if not state['scrape_media'] or channel_id in media_requeued:
+        return
+    media_requeued.add(channel_id)
+    db_file = os.path.join(os.getcwd(), channel_id, f'{channel_id}.db')
+    message_ids = await db_thread.run(missing_media_ids, db_file)
+    if message_ids:
+        print(f"\nQueueing {len(message_ids)} media downloads left unfinished last time")
+    for start in range(0, len(message_ids), RESCRAPE_BATCH_SIZE):
+        await queue_media_batch(client, entity, writer, message_ids[start:start + RESCRAPE_BATCH_SIZE])
 
 async def rescrape_media(channel_id):
+    """Download media that is missing for already scraped messages.
+
+    The channel is resolved once, messages are fetched RESCRAPE_BATCH_SIZE ids
+    at a time, and downloads go through the media pipeline so they run
+    concurrently and their media_path updates are committed in batches.
+    """
+    channel_id = str(channel_id)
     channel_dir = os.path.join(os.getcwd(), channel_id)
     db_file = os.path.join(channel_dir, f'{channel_id}.db')
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
-    c.execute('SELECT message_id FROM messages WHERE media_type IS NOT NULL AND media_path IS NULL')
-    rows = c.fetchall()
-    conn.close()
+    message_ids = await db_thread.run(missing_media_ids, db_file)
 
-    total_messages = len(rows)
+    total_messages = len(message_ids)
     if total_messages == 0:
         print(f"No media files to reprocess for channel {channel_id}.")
         return
 
-    for index, (message_id,) in enumerate(rows):
+    client, entity = await resolve_assigned_channel(channel_id)
+    media = get_media_pipeline()
+    
+    async with MessageWriter(channel_id) as writer:
         try:
-            entity = await client.get_entity(PeerChannel(int(channel_id)))
-            message = await client.get_messages(entity, ids=message_id)
-            media_path = await download_media(channel_id, message)
-            if media_path:
-                conn = sqlite3.connect(db_file)
-                c = conn.cursor()
-                c.execute('''UPDATE messages SET media_path = ? WHERE message_id = ?''', (media_path, message_id))
-                conn.commit()
-                conn.close()
-            
-            progress = (index + 1) / total_messages * 100
-            sys.stdout.write(f"\rReprocessing media for channel {channel_id}: {progress:.2f}% complete")
-            sys.stdout.flush()
-        except Exception as e:
-            print(f"Error reprocessing message {message_id}: {e}")
-    print()
+            for start in range(0, total_messages, RESCRAPE_BATCH_SIZE):
+                batch = message_ids[start:start + RESCRAPE_BATCH_SIZE]
+                await queue_media_batch(client, entity, writer, batch)
+                
+                progress = (start + len(batch)) / total_messages * 100
+                sys.stdout.write(f"\rReprocessing media for channel {channel_id}: {progress:.2f}% queued")
+                sys.stdout.flush()
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            media.abandon(writer)
+            raise
+        finally:
+            await media.drain(channel_id)
+    
+    remaining = await db_thread.run(count_missing_media, db_file)
+    print(f"\nReprocessed media for channel {channel_id}: "
+          f"{total_messages - remaining} of {total_messages} files downloaded")
+
+def storage_channel_id(chat_id):
+    """Channel ID as stored in state, without the -100 prefix"""
+    channel_id = str(chat_id)
+    if channel_id.startswith('-100'):
+        return channel_id[4:]
+    if channel_id.startswith('-'):
+        return channel_id[1:]
+    return channel_id
+
+ENTITY_CACHE_FILE = 'entity_cache.json'
+ENTITY_CACHE_TTL = 24 * 60 * 60  # seconds
+# Errors that mean a cached entity is stale; Telethon raises ValueError when it can't resolve one
+STALE_ENTITY_ERRORS = (errors.ChannelInvalidError, errors.ChannelPrivateError,
+                       errors.PeerIdInvalidError, ValueError)
 
-async def resolve_channel(channel_input):
-    """Resolve channel name/ID to a proper channel entity"""
+class EntityCache:
+    """Persistent cache of resolved channels so repeat scrapes need no API calls.
+
+    Stores the id, title and username of every channel that resolve_channel
+    has found along with the access hash of each account that resolved it,
+    plus the inputs (IDs, usernames, titles) that led to it. Entries older
+    than ttl seconds are resolved again, and invalidate() drops a channel
+    whose cached entity stopped working.
+    """
+    
+    def __init__(self, path=ENTITY_CACHE_FILE, ttl=ENTITY_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.entities = {}
+        self.aliases = {}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                self.entities = data.get('entities', {})
+                self.aliases = data.get('aliases', {})
+                # Caches from before multi-account support held the main account's hash
+                for entry in self.entities.values():
+                    if 'access_hash' in entry:
+                        entry['access_hashes'] = {PRIMARY_SESSION: entry.pop('access_hash')}
+            except ValueError:
+                print(f"Ignoring unreadable entity cache {path}")
+    
+    @staticmethod
+    def key(channel_input):
+        key = str(channel_input).strip()
+        if key.startswith('-'):
+            key = storage_channel_id(key)
+        return key if key.isdigit() else key.lower()
+    
+    def save(self):
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'entities': self.entities, 'aliases': self.aliases}, f)
+        os.replace(tmp_file, self.path)
+    
+    def get(self, channel_input, account=PRIMARY_SESSION):
+        key = self.key(channel_input)
+        entry = self.entities.get(self.aliases.get(key, key))
+        if not entry or account not in entry['access_hashes']:
+            self.misses += 1
+            return None
+        if time.time() - entry['resolved_at'] > self.ttl:
+            self.expired += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Channel(id=entry['id'], title=entry['title'], photo=ChatPhotoEmpty(), date=None,
+                       access_hash=entry['access_hashes'][account], username=entry['username'])
+    
+    def put(self, channel_input, entity, account=PRIMARY_SESSION):
+        # Only channels carry the access hash needed to rebuild them offline
+        if not isinstance(entity, Channel) or entity.access_hash is None:
+            return
+        channel_id = str(entity.id)
+        access_hashes = self.entities.get(channel_id, {}).get('access_hashes', {})
+        access_hashes[account] = entity.access_hash
+        self.entities[channel_id] = {
+            'id': entity.id,
+            'access_hashes': access_hashes,
+            'title': entity.title,
+            'username': entity.username,
+            'resolved_at': time.time()
+        }
+        self.aliases[self.key(channel_input)] = channel_id
+        if entity.username:
+            self.aliases[entity.username.lower()] = channel_id
+        self.save()
+    
+    def invalidate(self, channel_id):
+        channel_id = self.key(channel_id)
+        if self.entities.pop(channel_id, None):
+            self.invalidations += 1
+        self.aliases = {alias: target for alias, target in self.aliases.items() if target != channel_id}
+        self.save()
+    
+    def clear(self):
+        self.entities = {}
+        self.aliases = {}
+        self.save()
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entities)
+        }
+
+entity_cache = EntityCache()
+
+def print_entity_cache_stats():
+    stats = entity_cache.stats()
+    print(f"Entity cache: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['expired']} expired), {stats['invalidations']} invalidations, "
+          f"{stats['hit_rate']:.0%} hit rate, {stats['entries']} channels cached")
+
+async def resolve_channel(channel_input, client=None):
+    """Resolve channel name/ID to a channel entity, using the entity cache when possible.
+
+    Entities are resolved for `client`, the main account by default, since
+    access hashes differ from one account to the next.
+    """
+    client = client or pool.primary
+    account = pool.account_of(client)
+    with tracer.span('resolve_channel', channel=str(channel_input), account=account) as span:
+        entity = entity_cache.get(channel_input, account)
+        if entity:
+            span.set(cached=True)
+            return entity
+        entity = await lookup_channel(channel_input, client)
+        entity_cache.put(channel_input, entity, account)
+        return entity
+
+async def lookup_channel(channel_input, client):
+    """Resolve channel name/ID to a proper channel entity through the API"""
     try:
         # Handle channel IDs with or without -100 prefix
         if str(channel_input).startswith('-100'):
@@ -301,6 +1881,34 @@ async def resolve_channel(channel_input):
     except Exception as e:
         raise ValueError(f"Error resolving channel {channel_input}: {e}")
 
+async def resolve_assigned_channel(channel_id):
+    """Resolve a saved channel for the account assigned to it, returning (client, entity).
+
+    Consistent hashing and flood-wait rebalancing can hand a channel to an
+    account that has never seen it, and such an account can't resolve a
+    bare ID. The channel's username is tried next, which works for public
+    channels, and if the account still can't see it the main account
+    scrapes it instead.
+    """
+    channel_id = storage_channel_id(channel_id)
+    username = (state.get('channel_details', {}).get(channel_id, {}).get('username') or
+                entity_cache.entities.get(channel_id, {}).get('username'))
+    clients = [pool.client_for(channel_id)]
+    if clients[0] is not pool.primary:
+        clients.append(pool.primary)
+    
+    error = None
+    for account_client in clients:
+        for channel_input in filter(None, [f"-100{channel_id}", username]):
+            try:
+                entity = await resolve_channel(channel_input, account_client)
+            except ValueError as e:
+                error = error or e
+                continue
+            if str(entity.id) == channel_id:
+                return account_client, entity
+    raise error or ValueError(f"Could not find channel: {channel_id}")
+
 async def add_channel(channel_input):
     """Add a channel with proper resolution"""
     try:
@@ -330,99 +1938,635 @@ async def add_channel(channel_input):
         print(f"Failed to add channel {channel_input}: {e}")
         return False
 
-async def scrape_channel(channel_id, offset_id=0):
-    """Scrape a channel using its ID"""
-    try:
-        # Add -100 prefix if not present for proper resolution
-        if not str(channel_id).startswith('-100'):
-            channel_id = f"-100{channel_id}"
-            
-        entity = await resolve_channel(channel_id)
-        if not entity:
-            print(f"Could not resolve channel {channel_id}")
-            return
+BACKFILL_SHARDS = 4  # message-id ranges fetched in parallel during a backfill
+SHARDED_BACKFILL_THRESHOLD = 50000  # messages behind the latest before a scrape is sharded
 
-        channel_title = entity.title if hasattr(entity, 'title') else str(entity.id)
-        print(f"\nScraping channel: {channel_title}")
-        
-        try:
-            total_messages = (await client.get_messages(entity, limit=1))[0].id
-            processed_messages = 0
-            
-            async for message in client.iter_messages(entity, offset_id=offset_id, reverse=True):
+def plan_backfill(offset_id, latest_id, shards=BACKFILL_SHARDS):
+    """Split the message ids after offset_id up to latest_id into contiguous shards"""
+    span = latest_id - offset_id
+    size = -(-span // shards)
+    plan = []
+    for start in range(offset_id, latest_id, size):
+        plan.append({'min_id': start, 'max_id': min(start + size, latest_id), 'done_up_to': start})
+    return {'latest_id': latest_id, 'shards': plan}
+
+async def backfill_channel(client, entity, storage_id, offset_id, latest_id, channel_title):
+    """Backfill a large channel by fetching several message-id ranges at once.
+
+    The plan and each shard's progress live in state['backfills'], so an
+    interrupted backfill only re-fetches what its unfinished shards were
+    missing. Every shard writes through the same MessageWriter, and the
+    channel's resume offset jumps to latest_id once all shards are done.
+    """
+    record = state['backfills'].get(storage_id)
+    if not record:
+        record = plan_backfill(offset_id, latest_id)
+        state['backfills'][storage_id] = record
+        checkpoints.changed()
+    latest_id = record['latest_id']
+    pending = [shard for shard in record['shards'] if shard['done_up_to'] < shard['max_id']]
+    print(f"Backfilling {channel_title} up to message {latest_id} "
+          f"in {len(pending)} of {len(record['shards'])} shards")
+    
+    media = get_media_pipeline()
+    remaining = sum(shard['max_id'] - shard['done_up_to'] for shard in pending)
+    processed = 0
+    finished = []
+    
+    async def fetch_shard(shard, writer):
+        nonlocal processed
+        with tracer.span('backfill_shard', channel_id=storage_id, min_id=shard['done_up_to'],
+                         max_id=shard['max_id']):
+            async for message in client.iter_messages(entity, offset_id=shard['done_up_to'],
+                                                      max_id=shard['max_id'] + 1, reverse=True):
                 try:
-                    sender = await message.get_sender()
-                    # Use channel ID without -100 prefix for consistency with storage
-                    await save_message_to_db(message, channel_id[4:] if channel_id.startswith('-100') else channel_id)
+                    sender = await resolve_sender(message)
+                    await writer.add_message(message, sender=sender, shard=shard)
                     
                     if message.media and state['scrape_media']:
-                        media_path = await download_media(channel_id[4:] if channel_id.startswith('-100') else channel_id,
-                                                       message)
-                        
-                        if media_path:
-                            conn = sqlite3.connect(os.path.join(os.getcwd(), 
-                                                              channel_id[4:] if channel_id.startswith('-100') else channel_id, 
-                                                              f'{channel_id[4:] if channel_id.startswith('-100') else channel_id}.db'))
-                            c = conn.cursor()
-                            c.execute('''UPDATE messages SET media_path = ? WHERE message_id = ?''', 
-                                    (media_path, message.id))
-                            conn.commit()
-                            conn.close()
+                        await media.put(writer, message)
                     
-                    last_message_id = message.id
-                    processed_messages += 1
-
-                    progress = (processed_messages / total_messages) * 100
-                    sys.stdout.write(f"\rScraping channel: {channel_title} - Progress: {progress:.2f}%")
+                    processed += 1
+                    progress = min(processed / remaining * 100, 100) if remaining else 100
+                    sys.stdout.write(f"\rBackfilling channel: {channel_title} - Progress: {progress:.2f}%")
                     sys.stdout.flush()
-
-                    state['channels'][channel_id[4:] if channel_id.startswith('-100') else channel_id] = last_message_id
-                    save_state(state)
                 except Exception as e:
                     print(f"\nError processing message {message.id}: {e}")
-            print()
+        finished.append(shard)
+    
+    async with MessageWriter(storage_id) as writer:
+        try:
+            media.feed(writer, requeue_missing_media(client, entity, writer))
+            results = await asyncio.gather(*(fetch_shard(shard, writer) for shard in pending),
+                                           return_exceptions=True)
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            media.abandon(writer)
+            raise
+        finally:
+            await media.drain(storage_id)
+    
+    # Everything the finished shards fetched is committed now
+    for shard in finished:
+        shard['done_up_to'] = shard['max_id']
+    for error in results:
+        if isinstance(error, Exception):
+            print(f"\nBackfill shard failed, it will resume on the next scrape: {error}")
+    
+    if all(shard['done_up_to'] >= shard['max_id'] for shard in record['shards']):
+        del state['backfills'][storage_id]
+        checkpoints.advance(storage_id, latest_id)
+        print(f"\nBackfill of {channel_title} complete")
+    checkpoints.changed()
+    print()
+    return processed
+
+async def scrape_channel(channel_id, offset_id=0):
+    """Scrape a channel using its ID, returning the number of messages processed"""
+    with tracer.span('scrape_channel', channel_id=str(channel_id), offset_id=offset_id):
+        try:
+            # Add -100 prefix if not present for proper resolution
+            if not str(channel_id).startswith('-100'):
+                channel_id = f"-100{channel_id}"
+            
+            client, entity = await resolve_assigned_channel(channel_id)
+            if not entity:
+                print(f"Could not resolve channel {channel_id}")
+                return 0
+
+            channel_title = entity.title if hasattr(entity, 'title') else str(entity.id)
+            print(f"\nScraping channel: {channel_title}")
+            
+            # Use channel ID without -100 prefix for consistency with storage
+            storage_id = channel_id[4:] if channel_id.startswith('-100') else channel_id
+            
+            try:
+                total_messages = (await client.get_messages(entity, limit=1))[0].id
+                processed_messages = 0
+                
+                if (storage_id in state['backfills'] or
+                        total_messages - offset_id >= SHARDED_BACKFILL_THRESHOLD):
+                    processed_messages = await backfill_channel(client, entity, storage_id, offset_id,
+                                                                total_messages, channel_title)
+                    CHANNEL_LAST_SCRAPE.set(time.time(), channel=storage_id)
+                    return processed_messages
+                
+                media = get_media_pipeline()
+                async with MessageWriter(storage_id) as writer:
+                    try:
+                        media.feed(writer, requeue_missing_media(client, entity, writer))
+                        async for message in client.iter_messages(entity, offset_id=offset_id, reverse=True):
+                            try:
+                                sender = await resolve_sender(message)
+                                await writer.add_message(message, sender=sender)
+                                
+                                if message.media and state['scrape_media']:
+                                    await media.put(writer, message)
+                                
+                                processed_messages += 1
+
+                                progress = (processed_messages / total_messages) * 100
+                                sys.stdout.write(f"\rScraping channel: {channel_title} - Progress: {progress:.2f}%")
+                                sys.stdout.flush()
+                            except Exception as e:
+                                print(f"\nError processing message {message.id}: {e}")
+                    except (asyncio.CancelledError, KeyboardInterrupt):
+                        # Stopping, so don't sit through the queued downloads
+                        media.abandon(writer)
+                        raise
+                    finally:
+                        # Downloads still write through this writer, so let them finish first
+                        await media.drain(storage_id)
+                print()
+                CHANNEL_LAST_SCRAPE.set(time.time(), channel=storage_id)
+                return processed_messages
+            except Exception as e:
+                if isinstance(e, STALE_ENTITY_ERRORS):
+                    # The cached entity may be what broke (e.g. a changed access hash)
+                    entity_cache.invalidate(storage_id)
+                print(f"\nError scraping messages: {e}")
+        except ValueError as e:
+            print(f"Error with channel {channel_id}: {e}")
+        return 0
+
+POLL_INTERVAL = 60  # seconds between checks of the same channel
+MIN_POLL_INTERVAL = 10  # busiest channels are never polled more often than this
+MAX_POLL_INTERVAL = 4 * 60 * 60  # quiet channels back off up to this
+TARGET_MESSAGES_PER_POLL = 20  # busy channels are polled about once per this many messages
+POLL_RATE_SMOOTHING = 0.3  # weight of the latest poll in the message rate average
+BACKFILL_MESSAGES = 1000  # a run this large marks the channel as backfilling
+CHANNEL_PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+class ScrapeScheduler:
+    """Runs scrape_channel for several channels at once.
+
+    Each channel is rescheduled after its own scrape finishes, so a long
+    backfill only holds up the worker running it. Due channels are picked by
+    priority, and backfilling channels are kept to all but one worker so live
+    channels always have a free slot.
+
+    Poll intervals adapt to each channel's observed message rate: busy
+    channels are checked more often than `interval`, quiet ones back off
+    exponentially up to MAX_POLL_INTERVAL. Rates, intervals and next-due
+    times are kept in state['poll_schedule'] so they survive restarts.
+    """
+    
+    def __init__(self, concurrency, interval=POLL_INTERVAL, min_interval=MIN_POLL_INTERVAL):
+        self.concurrency = max(1, concurrency)
+        self.interval = interval
+        self.min_interval = min(min_interval, interval)
+        self.schedule = state['poll_schedule']
+        self.due = {channel: entry['next_due'] for channel, entry in self.schedule.items()
+                    if channel in state['channels']}
+        self.running = set()
+        self.woken = set()
+        # Channels that have never been scraped start out as backfills
+        self.backfilling = {channel for channel, offset in state['channels'].items() if not offset}
+        self.changed = asyncio.Event()
+    
+    def priority(self, channel):
+        details = state.get('channel_details', {}).get(channel, {})
+        return CHANNEL_PRIORITIES.get(details.get('priority', 'normal'), CHANNEL_PRIORITIES['normal'])
+    
+    def sort_key(self, channel):
+        return (channel in self.backfilling, self.priority(channel), self.due[channel])
+    
+    def can_start(self, channel):
+        if channel not in self.backfilling or self.concurrency == 1:
+            return True
+        running_backfills = len(self.running & self.backfilling)
+        return running_backfills < self.concurrency - 1
+    
+    def sync_channels(self):
+        """Pick up channels added to or removed from state since the last pass"""
+        now = time.time()
+        for channel in state['channels']:
+            self.due.setdefault(channel, now)
+        for channel in list(self.due):
+            if channel not in state['channels'] and channel not in self.running:
+                del self.due[channel]
+                self.schedule.pop(channel, None)
+    
+    async def next_channel(self):
+        while continuous_scraping_active:
+            self.sync_channels()
+            now = time.time()
+            ready = [channel for channel, due in self.due.items()
+                     if due <= now and channel not in self.running and self.can_start(channel)]
+            if ready:
+                channel = min(ready, key=self.sort_key)
+                self.running.add(channel)
+                SCRAPES_RUNNING.set(len(self.running))
+                return channel
+            
+            waiting = [due for channel, due in self.due.items() if channel not in self.running]
+            timeout = max(min(waiting, default=now + self.interval) - now, 0.1)
+            self.changed.clear()
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return None
+    
+    def wake(self, channel):
+        """Make a channel due now, or straight after its current scrape"""
+        if channel in self.running:
+            self.woken.add(channel)
+        elif channel in self.due:
+            self.due[channel] = min(self.due[channel], time.time())
+        self.changed.set()
+    
+    def next_interval(self, channel, processed, now):
+        """Update the channel's message rate and return its next poll interval"""
+        entry = self.schedule.setdefault(channel, {'interval': self.interval, 'rate': 0.0,
+                                                   'last_poll': None, 'next_due': now})
+        last_poll = entry['last_poll']
+        entry['last_poll'] = now
+        
+        if processed >= BACKFILL_MESSAGES:
+            # Still catching up on history, which says nothing about the live rate
+            return self.min_interval
+        
+        if last_poll:
+            observed = processed / max(now - last_poll, 1)
+            entry['rate'] = POLL_RATE_SMOOTHING * observed + (1 - POLL_RATE_SMOOTHING) * entry['rate']
+        
+        if processed:
+            interval = TARGET_MESSAGES_PER_POLL / entry['rate'] if entry['rate'] else self.interval
+            return min(max(interval, self.min_interval), self.interval)
+        return min(entry['interval'] * 2, max(MAX_POLL_INTERVAL, self.interval))
+    
+    def finished(self, channel, processed):
+        self.running.discard(channel)
+        SCRAPES_RUNNING.set(len(self.running))
+        if processed >= BACKFILL_MESSAGES:
+            self.backfilling.add(channel)
+        else:
+            self.backfilling.discard(channel)
+        if channel in self.due:
+            now = time.time()
+            interval = self.next_interval(channel, processed, now)
+            entry = self.schedule[channel]
+            entry['interval'] = interval
+            entry['next_due'] = now if channel in self.woken else now + interval
+            self.due[channel] = entry['next_due']
+            checkpoints.changed()
+        self.woken.discard(channel)
+        self.changed.set()
+    
+    async def worker(self):
+        while continuous_scraping_active:
+            channel = await self.next_channel()
+            if channel is None:
+                break
+            processed = 0
+            print(f"\nChecking for new messages in channel: {channel}")
+            try:
+                processed = await scrape_channel(channel, state['channels'][channel])
+                print(f"New messages or media scraped from channel: {channel}")
+            except Exception as e:
+                print(f"Error scraping channel {channel}: {e}")
+            finally:
+                self.finished(channel, processed)
+    
+    async def run(self):
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+GAP_SWEEP_INTERVAL = 15 * 60  # polling interval while real-time updates are on
+
+class RealtimeIngest:
+    """Writes messages pushed by Telegram straight into the channel databases.
+
+    A new message that directly follows a channel's stored offset is written
+    immediately. Anything else (a gap after a missed update, or a channel
+    that is being scraped right now) is handed to the scheduler as an
+    immediate catch-up scrape, so the resume offset never skips a message.
+    """
+    
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.media_tasks = set()
+    
+    def start(self):
+        # Any account in the pool may be a member of a channel, so listen on all of them.
+        # The same message arriving twice is dropped by the offset check below.
+        for account_client in pool.clients.values():
+            account_client.add_event_handler(self.on_new_message, events.NewMessage())
+            account_client.add_event_handler(self.on_message_edited, events.MessageEdited())
+    
+    async def stop(self):
+        for account_client in pool.clients.values():
+            account_client.remove_event_handler(self.on_new_message)
+            account_client.remove_event_handler(self.on_message_edited)
+        # Like Ctrl+C during a scrape, don't wait for downloads still in flight
+        for task in self.media_tasks:
+            task.cancel()
+        await asyncio.gather(*self.media_tasks, return_exceptions=True)
+    
+    async def on_new_message(self, event):
+        channel = storage_channel_id(event.chat_id)
+        if channel not in state['channels']:
+            return
+        
+        message = event.message
+        offset = state['channels'][channel]
+        if message.id <= offset:
+            return
+        if channel in self.scheduler.running or message.id != offset + 1:
+            self.scheduler.wake(channel)
+            return
+        
+        try:
+            sender = await resolve_sender(message)
+            if channel in self.scheduler.running or message.id != state['channels'][channel] + 1:
+                # A scrape started or another update landed while the sender was looked up
+                self.scheduler.wake(channel)
+                return
+            async with MessageWriter(channel) as writer:
+                await writer.add_message(message, sender=sender)
         except Exception as e:
-            print(f"\nError scraping messages: {e}")
-    except ValueError as e:
-        print(f"Error with channel {channel_id}: {e}")
+            print(f"\nError saving real-time message {message.id} in channel {channel}: {e}")
+            self.scheduler.wake(channel)
+            return
+        
+        if message.media and state['scrape_media']:
+            # Download in the background so the next update isn't held up
+            task = asyncio.create_task(self.save_media(channel, message))
+            self.media_tasks.add(task)
+            task.add_done_callback(self.media_tasks.discard)
+    
+    async def save_media(self, channel, message):
+        media = get_media_pipeline()
+        async with MessageWriter(channel) as writer:
+            try:
+                await media.put(writer, message)
+            except (asyncio.CancelledError, KeyboardInterrupt):
+                media.abandon(writer)
+                raise
+            finally:
+                await media.drain(channel)
+    
+    async def on_message_edited(self, event):
+        channel = storage_channel_id(event.chat_id)
+        if channel not in state['channels']:
+            return
+        
+        try:
+            async with MessageWriter(channel) as writer:
+                await writer.update_message_text(event.message.id, event.message.message)
+        except Exception as e:
+            print(f"\nError saving edit of message {event.message.id} in channel {channel}: {e}")
+
+LOOP_LAG_INTERVAL = 0.1  # seconds between event loop lag samples
+LOOP_LAG_SAMPLES = 10000  # recent samples kept for percentiles
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a short sleep.
+
+    Anything that holds the loop thread, such as a SQLite commit waiting on
+    fsync, shows up as lag and delays every download and update in flight.
+    """
+    
+    def __init__(self, interval=LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.samples = deque(maxlen=LOOP_LAG_SAMPLES)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.task = None
+    
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+    
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            self.samples.append(lag)
+            self.count += 1
+            self.total += lag
+            self.max = max(self.max, lag)
+            LOOP_LAG_SECONDS.observe(lag)
+    
+    def stats(self):
+        ordered = sorted(self.samples)
+        return {
+            'samples': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p99': ordered[int(len(ordered) * 0.99)] if ordered else 0.0,
+            'max': self.max
+        }
+
+def print_loop_lag_stats(monitor):
+    stats = monitor.stats()
+    print(f"Event loop lag: mean {stats['mean'] * 1000:.1f} ms, p99 {stats['p99'] * 1000:.1f} ms, "
+          f"max {stats['max'] * 1000:.1f} ms over {stats['samples']} samples")
 
 async def continuous_scraping():
     global continuous_scraping_active
     continuous_scraping_active = True
+    
+    realtime = None
+    lag_monitor = LoopLagMonitor()
+    if state['realtime_updates']:
+        # Update handlers keep busy channels current, so sweeps never need to run faster
+        interval = GAP_SWEEP_INTERVAL
+        scheduler = ScrapeScheduler(state['scrape_concurrency'], interval, min_interval=interval)
+    else:
+        interval = POLL_INTERVAL
+        scheduler = ScrapeScheduler(state['scrape_concurrency'], interval)
 
     print("\nStarting continuous scraping mode...")
+    if state['realtime_updates']:
+        print("Listening for new messages in real time, "
+              f"with a gap-filling sweep every {interval // 60} minutes")
+    else:
+        print(f"Checking busy channels every {MIN_POLL_INTERVAL}-{interval} seconds, "
+              f"quiet ones up to every {MAX_POLL_INTERVAL // 3600} hours")
+    print(f"Scraping up to {state['scrape_concurrency']} channels at once")
     print("Press Ctrl+C to stop scraping and return to menu")
     print("=" * 50)
 
     try:
-        while continuous_scraping_active:
-            for channel in state['channels']:
-                if not continuous_scraping_active:
-                    break
-                print(f"\nChecking for new messages in channel: {channel}")
-                try:
-                    await scrape_channel(channel, state['channels'][channel])
-                    print(f"New messages or media scraped from channel: {channel}")
-                except Exception as e:
-                    print(f"Error scraping channel {channel}: {e}")
-                    continue
-            
-            print("\nWaiting 60 seconds before next check... (Press Ctrl+C to stop)")
-            try:
-                await asyncio.sleep(60)
-            except asyncio.CancelledError:
-                raise
+        lag_monitor.start()
+        if state['realtime_updates']:
+            realtime = RealtimeIngest(scheduler)
+            realtime.start()
+        await scheduler.run()
     except (asyncio.CancelledError, KeyboardInterrupt):
         continuous_scraping_active = False
+        checkpoints.flush()
         print("\nStopping continuous scraping...")
+        print_entity_cache_stats()
+        print_rate_limit_stats()
+        print_loop_lag_stats(lag_monitor)
         print("Returning to menu...")
+    finally:
+        await lag_monitor.stop()
+        if realtime:
+            await realtime.stop()
+
+EXPORT_CHUNK_SIZE = 1000  # rows fetched from SQLite at a time while exporting
+EXPORT_FORMATS = ['json', 'ndjson', 'parquet']
+
+def iter_rows(cursor, size=EXPORT_CHUNK_SIZE):
+    """Yield the rows of an executed cursor, fetching them a chunk at a time"""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+def iter_records(conn, query):
+    """Yield each row of a query as a dict keyed by column name"""
+    c = conn.execute(query)
+    columns = [description[0] for description in c.description]
+    for row in iter_rows(c):
+        yield dict(zip(columns, row))
+
+def write_json_array(f, records):
+    """Write records as a JSON array one element at a time, returning how many were written"""
+    count = 0
+    f.write('[')
+    for record in records:
+        f.write(',\n        ' if count else '\n        ')
+        f.write(json.dumps(record, ensure_ascii=False))
+        count += 1
+    f.write('\n    ]' if count else ']')
+    return count
+
+def write_csv(path, header, rows):
+    """Write a header and rows to a CSV file, replacing it only once complete"""
+    with open(path + '.tmp', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(path + '.tmp', path)
+
+def write_ndjson(path, records):
+    """Write records to an NDJSON file, one JSON object per line"""
+    count = 0
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write('\n')
+            count += 1
+    os.replace(path + '.tmp', path)
+    return count
+
+async def export_data(full=True):
+    """Export every channel, either in full or only what changed since the last export"""
+    channels = list(state['channels'])
+    if state['parallel_export'] and len(channels) > 1:
+        await export_parallel(channels, full)
+        return
+    for channel in channels:
+        ok, watermark = await export_channel(channel, state['export_format'], full,
+                                             state['exports'].get(channel))
+        if watermark:
+            state['exports'][channel] = watermark
+            save_state(state)
+
+async def export_channel(channel_id, export_format, full=True, watermark=None):
+    """Export one channel, returning whether it worked and the new incremental watermark"""
+    if not full:
+        watermark = await export_incremental(channel_id, watermark)
+        return watermark is not None, watermark
+    print(f"\nExporting data for channel: {channel_id}")
+    exporter = {'ndjson': export_to_ndjson, 'parquet': export_to_parquet}.get(export_format, export_to_json)
+    ok = await export_to_csv(channel_id)
+    ok = await exporter(channel_id) and ok
+    if ok:
+        print(f"Exported data for {channel_id} to CSV and {export_format.upper()} files")
+    return bool(ok), None
+
+EXPORT_START_METHOD = 'spawn'  # forking would copy the Telegram and database threads into workers
+
+def export_worker_count(channels):
+    """One worker per available core, but no more than there are channels"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(1, min(channels, cores))
+
+def export_channel_job(channel_id, export_format, full, watermark):
+    """Export one channel in a worker process.
+
+    Returns (succeeded, watermark, seconds, output); the export's output is
+    captured so the parent can print each channel's log in one piece.
+    """
+    started = time.monotonic()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        ok, watermark = asyncio.run(export_channel(channel_id, export_format, full, watermark))
+    return ok, watermark, time.monotonic() - started, output.getvalue()
+
+async def export_parallel(channels, full):
+    """Export channels across a pool of worker processes, one channel per job.
+
+    Each channel's SQLite file is independent, so the exports scale with the
+    number of cores. A channel that fails is reported and the others carry
+    on. Workers hand their incremental watermarks back and only this process
+    writes them to state.json.
+    """
+    loop = asyncio.get_running_loop()
+    workers = export_worker_count(len(channels))
+    print(f"\nExporting {len(channels)} channels with {workers} worker processes...")
+    started = time.monotonic()
+    failed = []
+    
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context(EXPORT_START_METHOD)) as executor:
+        async def export(channel):
+            try:
+                return channel, await loop.run_in_executor(executor, export_channel_job, channel,
+                                                           state['export_format'], full,
+                                                           state['exports'].get(channel))
+            except Exception as e:
+                return channel, e
+        
+        for finished, job in enumerate(asyncio.as_completed([export(channel) for channel in channels]), 1):
+            channel, result = await job
+            if isinstance(result, Exception):
+                failed.append(channel)
+                print(f"[{finished}/{len(channels)}] {channel} failed: {result}")
+                continue
+            ok, watermark, seconds, output = result
+            print(output, end='')
+            if watermark:
+                state['exports'][channel] = watermark
+                checkpoints.changed()
+            if not ok:
+                failed.append(channel)
+            print(f"[{finished}/{len(channels)}] {channel} {'done' if ok else 'failed'} in {seconds:.1f}s")
+    checkpoints.flush()
+    
+    print(f"\nExported {len(channels) - len(failed)} of {len(channels)} channels "
+          f"in {time.monotonic() - started:.1f}s")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
 
-async def export_data():
-    for channel in state['channels']:
-        print(f"\nExporting data for channel: {channel}")
-        await export_to_csv(channel)
-        await export_to_json(channel)
-        print(f"Exported data for {channel} to CSV and JSON files")
+# Sender names live in the senders table; exports join them back in
+MESSAGES_EXPORT_QUERY = '''SELECT m.id, m.message_id, m.date, m.sender_id, s.first_name, s.last_name, 
+                                  s.username, m.message, m.media_type, m.media_path, m.mime_type, 
+                                  m.reply_to, m.transcript
+                           FROM messages m LEFT JOIN senders s ON s.sender_id = m.sender_id'''
+COMMENTS_EXPORT_QUERY = '''SELECT c.id, c.comment_id, c.message_id, c.date, c.sender_id, s.first_name, 
+                                  s.last_name, s.username, c.comment_text
+                           FROM comments c LEFT JOIN senders s ON s.sender_id = c.sender_id'''
 
 async def export_to_csv(channel_id):
     """Export messages and comments to CSV files"""
@@ -435,6 +2579,7 @@ async def export_to_csv(channel_id):
             return
         
         conn = sqlite3.connect(db_file)
+        migrate_db(conn)
         c = conn.cursor()
         
         try:
@@ -443,23 +2588,19 @@ async def export_to_csv(channel_id):
             c.execute('''SELECT message_id, date, message, media_type, media_path, mime_type, transcript
                         FROM messages''')
             
-            with open(output_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow(['Message ID', 'Date', 'Message', 'Media Type', 'Media Path', 'MIME Type', 'Transcript'])
-                writer.writerows(c.fetchall())
+            write_csv(output_file, ['Message ID', 'Date', 'Message', 'Media Type', 'Media Path', 'MIME Type',
+                                    'Transcript'], iter_rows(c))
             
             print(f"Messages exported to {output_file}")
             
             # Export comments
             output_file = os.path.join(channel_dir, f'{channel_id}_comments.csv')
-            c.execute('SELECT * FROM comments')
+            c.execute(COMMENTS_EXPORT_QUERY)
             
-            with open(output_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([description[0] for description in c.description])
-                writer.writerows(c.fetchall())
+            write_csv(output_file, [description[0] for description in c.description], iter_rows(c))
             
             print(f"Comments exported to {output_file}")
+            return True
         except Exception as e:
             print(f"Error writing CSV file: {str(e)}")
         finally:
@@ -469,6 +2610,11 @@ async def export_to_csv(channel_id):
         print(f"Error exporting to CSV: {str(e)}")
 
 async def export_to_json(channel_id):
+    """Export messages and comments to one JSON file.
+
+    Rows are streamed from SQLite and written as they are read, so memory
+    use stays flat however large the channel is.
+    """
     channel_dir = os.path.join(os.getcwd(), channel_id)
     db_file = os.path.join(channel_dir, f'{channel_id}.db')
     json_file = os.path.join(channel_dir, f'{channel_id}.json')
@@ -479,33 +2625,329 @@ async def export_to_json(channel_id):
         
     try:
         conn = sqlite3.connect(db_file)
-        c = conn.cursor()
-        
-        # Get messages
-        c.execute('''SELECT * FROM messages''')
-        columns = [description[0] for description in c.description]
-        messages = [dict(zip(columns, row)) for row in c.fetchall()]
-        
-        # Get comments
-        c.execute('''SELECT * FROM comments''')
-        comment_columns = [description[0] for description in c.description]
-        comments = [dict(zip(comment_columns, row)) for row in c.fetchall()]
-        
-        # Combine data
-        data = {
-            'channel': channel_id,
-            'messages': messages,
-            'comments': comments
-        }
+        migrate_db(conn)
         
-        with open(json_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-            
-        conn.close()
+        try:
+            with tracer.span('export_json', channel_id=channel_id), \
+                    open(json_file + '.tmp', 'w', encoding='utf-8') as f:
+                f.write('{\n    "channel": ' + json.dumps(channel_id) + ',\n    "messages": ')
+                write_json_array(f, iter_records(conn, MESSAGES_EXPORT_QUERY))
+                f.write(',\n    "comments": ')
+                write_json_array(f, iter_records(conn, COMMENTS_EXPORT_QUERY))
+                f.write('\n}\n')
+            os.replace(json_file + '.tmp', json_file)
+        finally:
+            conn.close()
         print(f"JSON export completed for {channel_id}")
+        return True
     except Exception as e:
         print(f"Error exporting to JSON for channel {channel_id}: {e}")
 
+async def export_to_ndjson(channel_id):
+    """Export messages and comments to NDJSON files, streamed like export_to_json"""
+    channel_dir = os.path.join(os.getcwd(), channel_id)
+    db_file = os.path.join(channel_dir, f'{channel_id}.db')
+    
+    if not os.path.exists(db_file):
+        print(f"No database file found for channel {channel_id}")
+        return
+    
+    try:
+        conn = sqlite3.connect(db_file)
+        migrate_db(conn)
+        
+        try:
+            with tracer.span('export_ndjson', channel_id=channel_id):
+                messages = write_ndjson(os.path.join(channel_dir, f'{channel_id}_messages.ndjson'),
+                                        iter_records(conn, MESSAGES_EXPORT_QUERY))
+                comments = write_ndjson(os.path.join(channel_dir, f'{channel_id}_comments.ndjson'),
+                                        iter_records(conn, COMMENTS_EXPORT_QUERY))
+        finally:
+            conn.close()
+        print(f"NDJSON export completed for {channel_id}: {messages} messages, {comments} comments")
+        return True
+    except Exception as e:
+        print(f"Error exporting to NDJSON for channel {channel_id}: {e}")
+
+PARQUET_DIR = 'parquet'  # <channel>/parquet/<table>/day=YYYY-MM-DD/part-0.parquet
+PARQUET_BATCH_ROWS = 50000  # rows per record batch read from SQLite
+PARQUET_COMPRESSION = 'zstd'
+
+def parquet_schemas(pa):
+    """Arrow schemas for the exported tables, in MESSAGES/COMMENTS_EXPORT_QUERY column order"""
+    integer, text, timestamp = pa.int64(), pa.string(), pa.timestamp('us', tz='UTC')
+    sender = [('sender_id', integer), ('first_name', text), ('last_name', text), ('username', text)]
+    return {
+        'messages': pa.schema([('id', integer), ('message_id', integer), ('date', timestamp)] + sender +
+                              [('message', text), ('media_type', text), ('media_path', text),
+                               ('mime_type', text), ('reply_to', integer), ('transcript', text),
+                               ('channel_id', text)]),
+        'comments': pa.schema([('id', integer), ('comment_id', integer), ('message_id', integer),
+                               ('date', timestamp)] + sender +
+                              [('comment_text', text), ('channel_id', text)]),
+    }
+
+def write_parquet_table(conn, query, schema, table_dir, channel_id):
+    """Write a query's rows, ordered by date, to one Parquet file per day.
+
+    Rows come from SQLite PARQUET_BATCH_ROWS at a time and each run of rows
+    from the same day is written as a record batch, so only one batch and
+    one open file are held at once. Returns the number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    
+    date_index = schema.get_field_index('date')
+    c = conn.execute(query)
+    writer = None
+    day = None
+    count = 0
+    try:
+        while True:
+            rows = c.fetchmany(PARQUET_BATCH_ROWS)
+            if not rows:
+                break
+            start = 0
+            while start < len(rows):
+                row_day = (rows[start][date_index] or '')[:10] or 'unknown'
+                end = start + 1
+                while end < len(rows) and ((rows[end][date_index] or '')[:10] or 'unknown') == row_day:
+                    end += 1
+                if row_day != day:
+                    if writer:
+                        writer.close()
+                    day_dir = os.path.join(table_dir, f'day={row_day}')
+                    os.makedirs(day_dir, exist_ok=True)
+                    writer = pq.ParquetWriter(os.path.join(day_dir, 'part-0.parquet'), schema,
+                                              compression=PARQUET_COMPRESSION)
+                    day = row_day
+                columns = list(zip(*rows[start:end])) + [[channel_id] * (end - start)]
+                arrays = [pc.cast(pa.array(column, pa.string()), field.type) if field.name == 'date'
+                          else pa.array(column, field.type)
+                          for column, field in zip(columns, schema)]
+                writer.write_batch(pa.record_batch(arrays, schema=schema))
+                count += end - start
+                start = end
+    finally:
+        if writer:
+            writer.close()
+    return count
+
+async def export_to_parquet(channel_id):
+    """Export messages and comments to compressed Parquet files partitioned by day.
+
+    Each table gets a hive-style <table>/day=YYYY-MM-DD/ directory per day,
+    so readers such as pyarrow.dataset, DuckDB or Spark only open the days
+    and columns a query needs. Needs pyarrow, which is only imported here.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        print("Parquet export needs pyarrow: pip install pyarrow")
+        return
+    
+    channel_dir = os.path.join(os.getcwd(), channel_id)
+    db_file = os.path.join(channel_dir, f'{channel_id}.db')
+    
+    if not os.path.exists(db_file):
+        print(f"No database file found for channel {channel_id}")
+        return
+    
+    try:
+        conn = sqlite3.connect(db_file)
+        migrate_db(conn)
+        
+        output_dir = os.path.join(channel_dir, PARQUET_DIR)
+        temp_dir = output_dir + '.tmp'
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        schemas = parquet_schemas(pa)
+        try:
+            with tracer.span('export_parquet', channel_id=channel_id):
+                messages = write_parquet_table(conn, MESSAGES_EXPORT_QUERY + ' ORDER BY m.date, m.id',
+                                               schemas['messages'], os.path.join(temp_dir, 'messages'),
+                                               channel_id)
+                comments = write_parquet_table(conn, COMMENTS_EXPORT_QUERY + ' ORDER BY c.date, c.id',
+                                               schemas['comments'], os.path.join(temp_dir, 'comments'),
+                                               channel_id)
+        finally:
+            conn.close()
+        
+        # Swap the finished export in so readers never see a half-written one
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.rename(temp_dir, output_dir)
+        print(f"Parquet export completed for {channel_id}: {messages} messages, {comments} comments")
+        return True
+    except Exception as e:
+        print(f"Error exporting to Parquet for channel {channel_id}: {e}")
+
+EXPORT_SEGMENT_DIR = 'export'  # incremental segments live in <channel>/export
+EXPORT_SEGMENT_ROWS = 100000  # rows per segment before a new one is started
+EXPORT_SEGMENT_FORMATS = ['csv', 'ndjson']
+
+def new_export_watermark():
+    return {'message_rowid': 0, 'comment_rowid': 0, 'change_seq': 0,
+            'segment': 1, 'segment_rows': 0, 'segment_bytes': {}}
+
+class SegmentWriter:
+    """Appends export rows to a channel's numbered segment files.
+
+    Segments are messages-00001.csv/.ndjson, comments-00001.csv/.ndjson and
+    so on, and a new number is started once a segment holds
+    EXPORT_SEGMENT_ROWS rows. The watermark records how many bytes of the
+    current segment were committed, so anything a crashed export appended
+    after that is cut off again before the next one writes, and segments it
+    rotated to are deleted.
+    """
+    
+    def __init__(self, export_dir, watermark):
+        self.export_dir = export_dir
+        self.watermark = watermark
+        self.files = {}
+        self.rows = 0
+        os.makedirs(export_dir, exist_ok=True)
+        self.rollback()
+    
+    def path(self, table, fmt):
+        return os.path.join(self.export_dir, f"{table}-{self.watermark['segment']:05d}.{fmt}")
+    
+    def rollback(self):
+        for name in os.listdir(self.export_dir):
+            table, _, rest = name.partition('-')
+            number = rest.split('.')[0]
+            if (table in ('messages', 'comments') and number.isdigit() and
+                    int(number) > self.watermark['segment']):
+                os.remove(os.path.join(self.export_dir, name))
+        
+        committed = self.watermark['segment_bytes']
+        for table in ('messages', 'comments'):
+            for fmt in EXPORT_SEGMENT_FORMATS:
+                path = self.path(table, fmt)
+                size = committed.get(os.path.basename(path), 0)
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    if size:
+                        os.truncate(path, size)
+                    else:
+                        os.remove(path)
+    
+    def open(self, table, columns):
+        if table not in self.files:
+            handles = {}
+            for fmt in EXPORT_SEGMENT_FORMATS:
+                path = self.path(table, fmt)
+                is_new = not os.path.exists(path)
+                handles[fmt] = open(path, 'a', newline='' if fmt == 'csv' else None, encoding='utf-8')
+                if fmt == 'csv':
+                    handles['writer'] = csv.writer(handles[fmt])
+                    if is_new:
+                        handles['writer'].writerow(columns)
+            self.files[table] = handles
+        return self.files[table]
+    
+    def write(self, table, columns, rows):
+        """Append rows for a table, rotating to a new segment between chunks"""
+        handles = self.open(table, columns)
+        handles['writer'].writerows(rows)
+        for row in rows:
+            handles['ndjson'].write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+            handles['ndjson'].write('\n')
+        self.rows += len(rows)
+        self.watermark['segment_rows'] += len(rows)
+        if self.watermark['segment_rows'] >= EXPORT_SEGMENT_ROWS:
+            self.close()
+            self.watermark['segment'] += 1
+            self.watermark['segment_rows'] = 0
+            self.watermark['segment_bytes'] = {}
+    
+    def close(self):
+        """Flush the open segment files and record their sizes in the watermark"""
+        for handles in self.files.values():
+            for fmt in EXPORT_SEGMENT_FORMATS:
+                handles[fmt].flush()
+                os.fsync(handles[fmt].fileno())
+                handles[fmt].close()
+                path = handles[fmt].name
+                self.watermark['segment_bytes'][os.path.basename(path)] = os.path.getsize(path)
+        self.files = {}
+
+def export_query_chunks(conn, query, params=()):
+    """Run an export query and yield its column names, then lists of up to EXPORT_CHUNK_SIZE rows"""
+    c = conn.execute(query, params)
+    yield [description[0] for description in c.description]
+    while True:
+        rows = c.fetchmany(EXPORT_CHUNK_SIZE)
+        if not rows:
+            return
+        yield rows
+
+def write_export_chunks(segments, table, chunks):
+    columns = next(chunks)
+    for rows in chunks:
+        segments.write(table, columns, rows)
+
+async def export_incremental(channel_id, watermark=None):
+    """Append what changed since the last export to the channel's export segments.
+
+    `watermark` is where the last export got to: the last exported row of
+    each table and the last change_seq. New messages and comments are
+    appended in insert order, and rows whose media path, text or transcript
+    changed after they were exported are appended again, so readers should
+    keep the last row they see for each message_id/comment_id. Returns the new
+    watermark, which the caller keeps in state['exports'], or None on error.
+    """
+    channel_dir = os.path.join(os.getcwd(), str(channel_id))
+    db_file = os.path.join(channel_dir, f'{channel_id}.db')
+    
+    if not os.path.exists(db_file):
+        print(f"No database file found for channel {channel_id}")
+        return
+    
+    try:
+        conn = sqlite3.connect(db_file)
+        migrate_db(conn)
+        watermark = dict(watermark or new_export_watermark())
+        watermark['segment_bytes'] = dict(watermark['segment_bytes'])
+        # Watermarks from before change_seq followed transcript_seq, which it is seeded from
+        watermark.setdefault('change_seq', watermark.pop('transcript_seq', 0))
+        
+        try:
+            # Everything up to these points is exported, whatever gets written meanwhile
+            message_rowid = conn.execute('SELECT COALESCE(MAX(id), 0) FROM messages').fetchone()[0]
+            comment_rowid = conn.execute('SELECT COALESCE(MAX(id), 0) FROM comments').fetchone()[0]
+            change_seq = next_change_seq(conn.cursor()) - 1
+            
+            with tracer.span('export_incremental', channel_id=str(channel_id)):
+                segments = SegmentWriter(os.path.join(channel_dir, EXPORT_SEGMENT_DIR), watermark)
+                try:
+                    write_export_chunks(segments, 'messages', export_query_chunks(
+                        conn, MESSAGES_EXPORT_QUERY + ' WHERE m.id > ? AND m.id <= ? ORDER BY m.id',
+                        (watermark['message_rowid'], message_rowid)))
+                    # Messages exported earlier that have changed since
+                    write_export_chunks(segments, 'messages', export_query_chunks(
+                        conn, MESSAGES_EXPORT_QUERY + ''' WHERE m.change_seq > ? AND m.change_seq <= ?
+                                                          AND m.id <= ? ORDER BY m.change_seq''',
+                        (watermark['change_seq'], change_seq, watermark['message_rowid'])))
+                    write_export_chunks(segments, 'comments', export_query_chunks(
+                        conn, COMMENTS_EXPORT_QUERY + ' WHERE c.id > ? AND c.id <= ? ORDER BY c.id',
+                        (watermark['comment_rowid'], comment_rowid)))
+                    write_export_chunks(segments, 'comments', export_query_chunks(
+                        conn, COMMENTS_EXPORT_QUERY + ''' WHERE c.change_seq > ? AND c.change_seq <= ?
+                                                          AND c.id <= ? ORDER BY c.change_seq''',
+                        (watermark['change_seq'], change_seq, watermark['comment_rowid'])))
+                finally:
+                    segments.close()
+        finally:
+            conn.close()
+        
+        # The segments are on disk, so the watermark can move past them
+        watermark.update(message_rowid=message_rowid, comment_rowid=comment_rowid,
+                         change_seq=change_seq)
+        print(f"Incremental export for {channel_id}: {segments.rows} new rows, "
+              f"now at segment {watermark['segment']}")
+        return watermark
+    except Exception as e:
+        print(f"Error in incremental export for channel {channel_id}: {e}")
+
 async def view_channels():
     """View detailed information about saved channels including message and media stats"""
     print("\nSaved Channels Statistics:")
@@ -564,7 +3006,7 @@ async def list_channels():
     """List all available channels with their details"""
     try:
         channels = []
-        async for dialog in client.iter_dialogs():
+        async for dialog in pool.primary.iter_dialogs():
             if dialog.is_channel:
                 channel_id = str(dialog.id)
                 if channel_id.startswith('-100'):
@@ -624,6 +3066,7 @@ async def manage_channels():
         print("[E] Export data")
         print("[N] Upload to Neo4j")
         print("[R] Remove channel")
+        print("[P] Set channel priority")
         print("[T] Transcribe media")
         print("[B] Back to main menu")
         
@@ -653,7 +3096,15 @@ async def manage_channels():
             await continuous_scraping()
             
         elif choice == 'E':
-            await export_data()
+            print("\n[I] Incremental export (only what changed since the last export)")
+            print("[F] Full re-export")
+            mode = input("Enter your choice (Enter for incremental): ").strip().upper()
+            if mode in ('', 'I'):
+                await export_data(full=False)
+            elif mode == 'F':
+                await export_data(full=True)
+            else:
+                print("Invalid choice.")
             
         elif choice == 'N':
             print("\nConnecting to Neo4j...")
@@ -688,12 +3139,33 @@ async def manage_channels():
                         del state['channels'][channel_id]
                         if 'channel_details' in state and channel_id in state['channel_details']:
                             del state['channel_details'][channel_id]
+                        state['poll_schedule'].pop(channel_id, None)
+                        state['backfills'].pop(channel_id, None)
+                        entity_cache.invalidate(channel_id)
                         save_state(state)
                         
                         print(f"Removed channel: {channel['title']} (ID: {channel_id})")
                 except ValueError:
                     continue
                 
+        elif choice == 'P':
+            channels = await list_saved_channels()
+            if channels:
+                print("\nEnter a number to set that channel's priority, or any other input to return to menu.")
+                try:
+                    idx = int(input("Channel number to change (or other input to cancel): "))
+                    if 1 <= idx <= len(channels):
+                        channel_id = channels[idx - 1]['id']
+                        priority = input("Priority [high/normal/low]: ").strip().lower()
+                        if priority in CHANNEL_PRIORITIES:
+                            state['channel_details'].setdefault(channel_id, {})['priority'] = priority
+                            save_state(state)
+                            print(f"Priority for {channels[idx - 1]['title']} set to {priority}")
+                        else:
+                            print("Invalid priority. Keeping current priority.")
+                except ValueError:
+                    continue
+                
         elif choice == 'T':
             channels = await list_saved_channels()
             if channels:
@@ -720,6 +3192,21 @@ async def main_menu():
         print("[M] Toggle Media Scraping (currently {})".format(
             "enabled" if state['scrape_media'] else "disabled"))
         print("[W] Change Whisper Model (currently {})".format(state['whisper_model']))
+        print("[K] Change Concurrent Scrapes (currently {})".format(state['scrape_concurrency']))
+        print("[H] Toggle Media Hash Verification (currently {})".format(
+            "enabled" if state['verify_media_hash'] else "disabled"))
+        print("[D] Change Media Download Workers (currently {})".format(state['media_workers']))
+        print("[U] Toggle Real-time Updates (currently {})".format(
+            "enabled" if state['realtime_updates'] else "disabled"))
+        print("[A] Manage Accounts (currently {})".format(len(pool.clients)))
+        print("[O] Metrics (currently {})".format(
+            f"port {state['metrics']['port']}" if state['metrics']['port'] else "disabled"))
+        print("[T] Toggle Tracing (currently {})".format(
+            ("enabled with profiling" if state['tracing']['profile'] else "enabled")
+            if state['tracing']['enabled'] else "disabled"))
+        print("[X] Change Export Format (currently {})".format(state['export_format']))
+        print("[P] Toggle Parallel Export (currently {})".format(
+            f"{export_worker_count(len(state['channels']))} processes" if state['parallel_export'] else "disabled"))
         print("[R] Reset Menu")
         print("[Q] Quit")
         
@@ -743,17 +3230,321 @@ async def main_menu():
                 print(f"Whisper model changed to: {model}")
             elif model:
                 print("Invalid model name. Keeping current model.")
+        elif choice == 'K':
+            try:
+                concurrency = int(input("\nNumber of channels to scrape at once: "))
+                if concurrency >= 1:
+                    state['scrape_concurrency'] = concurrency
+                    save_state(state)
+                    print(f"Concurrent scrapes set to: {concurrency}")
+                else:
+                    print("Value must be at least 1. Keeping current setting.")
+            except ValueError:
+                print("Invalid number. Keeping current setting.")
+        elif choice == 'H':
+            state['verify_media_hash'] = not state['verify_media_hash']
+            save_state(state)
+            print(f"Media hash verification {'enabled' if state['verify_media_hash'] else 'disabled'}.")
+        elif choice == 'D':
+            try:
+                workers = int(input("\nNumber of media files to download at once: "))
+                if workers >= 1:
+                    state['media_workers'] = workers
+                    save_state(state)
+                    print(f"Media download workers set to: {workers}")
+                else:
+                    print("Value must be at least 1. Keeping current setting.")
+            except ValueError:
+                print("Invalid number. Keeping current setting.")
+        elif choice == 'U':
+            state['realtime_updates'] = not state['realtime_updates']
+            save_state(state)
+            print(f"Real-time updates {'enabled' if state['realtime_updates'] else 'disabled'}.")
+        elif choice == 'A':
+            await manage_accounts()
+        elif choice == 'O':
+            port = input("\nPort for the local metrics endpoint (0 to disable, Enter to keep): ").strip()
+            if port:
+                try:
+                    state['metrics']['port'] = int(port) or None
+                except ValueError:
+                    print("Invalid port. Keeping current setting.")
+            json_file = input("File to dump metrics to as JSON (- to disable, Enter to keep): ").strip()
+            if json_file == '-':
+                state['metrics']['json_file'] = None
+            elif json_file:
+                state['metrics']['json_file'] = json_file
+            save_state(state)
+            stop_metrics()
+            start_metrics()
+        elif choice == 'T':
+            state['tracing']['enabled'] = not state['tracing']['enabled']
+            if state['tracing']['enabled']:
+                state['tracing']['profile'] = input("Also profile the run with cProfile? (y/N): ").lower() == 'y'
+                start_tracing()
+            else:
+                tracer.stop()
+            save_state(state)
+        elif choice == 'P':
+            state['parallel_export'] = not state['parallel_export']
+            save_state(state)
+            print(f"Parallel export {'enabled' if state['parallel_export'] else 'disabled'}.")
+        elif choice == 'X':
+            print(f"\nExport formats: {', '.join(EXPORT_FORMATS)}")
+            print("json writes one <channel>.json file, ndjson writes one JSON object per line,")
+            print("parquet writes compressed files per day for analytics tools (needs pyarrow)")
+            export_format = input("Enter format (or press Enter to keep current): ").strip().lower()
+            if export_format in EXPORT_FORMATS:
+                state['export_format'] = export_format
+                save_state(state)
+                print(f"Export format changed to: {export_format}")
+            elif export_format:
+                print("Invalid format. Keeping current format.")
         elif choice == 'R':
             await reset_menu()
         elif choice == 'Q':
+            checkpoints.flush()
             print("\nExiting program...")
             sys.exit()
         else:
             print("Invalid choice. Please try again.")
 
+NEO4J_BATCH_SIZE = 500  # rows per transaction to start with
+NEO4J_MIN_BATCH_SIZE = 50
+NEO4J_MAX_BATCH_SIZE = 10000
+NEO4J_TARGET_BATCH_SECONDS = 1.0  # batches grow while faster than this and shrink when slower
+NEO4J_RETRIES = 5  # attempts per batch after a transient error
+NEO4J_RETRY_DELAY = 0.5  # seconds before the first retry, doubled after each failure
+
+NEO4J_CONSTRAINTS = {
+    'channel_id': 'Channel',
+    'message_id': 'Message',
+    'media_id': 'Media',
+    'transcript_id': 'Transcript',
+    'comment_id': 'Comment',
+}
+
+NEO4J_MESSAGES_QUERY = """
+    MATCH (c:Channel {id: $channel_id})
+    UNWIND $rows AS row
+    MERGE (m:Message {id: row.id})
+    SET m.date = row.date,
+        m.message = row.message,
+        m.preview = row.preview,
+        m.reply_to = row.reply_to,
+        m.sender_name = row.sender_name,
+        m.username = row.username
+    MERGE (c)-[:HAS_MESSAGE]->(m)
+"""
+
+NEO4J_MEDIA_QUERY = """
+    UNWIND $rows AS row
+    MERGE (media:Media {id: row.id})
+    SET media += row.props
+    WITH media, row
+    MATCH (m:Message {id: row.message_id})
+    MERGE (m)-[:HAS_MEDIA]->(media)
+"""
+
+NEO4J_TRANSCRIPTS_QUERY = """
+    UNWIND $rows AS row
+    MERGE (t:Transcript {id: row.id})
+    SET t.transcript = row.transcript,
+        t.preview = row.preview
+    WITH t, row
+    MATCH (media:Media {id: row.media_id})
+    MERGE (media)-[:HAS_TRANSCRIPT]->(t)
+"""
+
+NEO4J_COMMENTS_QUERY = """
+    UNWIND $rows AS row
+    MERGE (c:Comment {id: row.id})
+    SET c.text = row.text,
+        c.preview = row.preview,
+        c.sender_name = row.sender_name,
+        c.username = row.username
+    WITH c, row
+    MATCH (m:Message {id: row.message_id})
+    MERGE (m)-[:HAS_COMMENT]->(c)
+"""
+
+class Neo4jBatcher:
+    """Writes rows to Neo4j in batches, one explicit transaction per batch.
+
+    The batch size adapts to how long transactions take: it doubles while
+    they finish well inside NEO4J_TARGET_BATCH_SECONDS and halves when they
+    run over, or when the server reports a transient error. Transient
+    errors (deadlocks, leader switches, lost connections) roll the batch
+    back, split it to the new batch size and retry the pieces with
+    exponential backoff.
+    """
+    
+    def __init__(self, session, batch_size=None):
+        from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
+        self.session = session
+        self.batch_size = batch_size or NEO4J_BATCH_SIZE
+        self.transient_errors = (ServiceUnavailable, SessionExpired, TransientError)
+        self.batches = 0
+        self.retries = 0
+    
+    def chunks(self, rows):
+        """Group rows into lists of the current batch size"""
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    async def write(self, work, rows, *args):
+        """Run work(tx, rows, *args) in a transaction and commit it, retrying transient errors.
+
+        work returns the number of nodes it wrote by kind, which are counted
+        once the transaction has committed.
+        """
+        batches = [(rows, 0)]
+        while batches:
+            rows, attempt = batches.pop(0)
+            started = time.monotonic()
+            try:
+                with self.session.begin_transaction() as tx:
+                    written = work(tx, rows, *args)
+                    tx.commit()
+            except self.transient_errors as e:
+                if attempt == NEO4J_RETRIES:
+                    raise
+                self.retries += 1
+                NEO4J_RETRIES_TOTAL.inc()
+                self.batch_size = max(NEO4J_MIN_BATCH_SIZE, min(self.batch_size, len(rows)) // 2)
+                # Retrying the same oversized batch would most likely fail the same way
+                batches[:0] = [(rows[i:i + self.batch_size], attempt + 1)
+                               for i in range(0, len(rows), self.batch_size)]
+                delay = NEO4J_RETRY_DELAY * 2 ** attempt
+                print(f"\nNeo4j batch failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            elapsed = time.monotonic() - started
+            NEO4J_BATCH_SECONDS.observe(elapsed)
+            self.batches += 1
+            for kind, count in written.items():
+                NEO4J_ROWS.inc(count, kind=kind)
+            if elapsed < NEO4J_TARGET_BATCH_SECONDS / 2:
+                self.batch_size = min(NEO4J_MAX_BATCH_SIZE, self.batch_size * 2)
+            elif elapsed > NEO4J_TARGET_BATCH_SECONDS * 2:
+                self.batch_size = max(NEO4J_MIN_BATCH_SIZE, self.batch_size // 2)
+
+def display_sender_name(sender_id, first_name, last_name, username):
+    if first_name or last_name:
+        return ' '.join(filter(None, [first_name, last_name]))
+    return username or str(sender_id)
+
+def text_preview(text):
+    """First 50 characters of a text, shortened with '...' if it is longer"""
+    return (text[:47] + "...") if text and len(text) > 50 else text
+
+def neo4j_message_rows(messages, channel_dir):
+    """Split a batch of message rows into Message, Media and Transcript parameters"""
+    message_rows, media_rows, transcript_rows = [], [], []
+    for (msg_id, date, message_text, media_type, media_path, mime_type, transcript, reply_to,
+         sender_id, first_name, last_name, username) in messages:
+        message_rows.append({
+            'id': str(msg_id),
+            'date': date,
+            'message': message_text,
+            'preview': text_preview(message_text),
+            'reply_to': str(reply_to) if reply_to else None,
+            'sender_name': display_sender_name(sender_id, first_name, last_name, username),
+            'username': username,
+        })
+        if not media_path:
+            continue
+        
+        # Media and transcript ids are hashes of the media path
+        media_hash = hashlib.md5(media_path.encode()).hexdigest()
+        media_props = {
+            'id': media_hash,
+            'type': media_type,
+            'mime_type': mime_type,
+            'path': media_path,
+            'filename': os.path.basename(media_path)
+        }
+        # Images get a file:/// thumbnail for the Neo4j browser
+        if mime_type and mime_type.startswith('image/'):
+            abs_path = os.path.abspath(os.path.join(channel_dir, 'media', media_path))
+            media_props['thumbnail'] = f"file:///{abs_path.replace(os.sep, '/')}"
+        media_rows.append({'id': media_hash, 'props': media_props, 'message_id': str(msg_id)})
+        
+        if transcript:
+            transcript_rows.append({
+                'id': hashlib.md5(f"{media_hash}_transcript".encode()).hexdigest(),
+                'transcript': transcript,
+                'preview': text_preview(transcript),
+                'media_id': media_hash,
+            })
+    return message_rows, media_rows, transcript_rows
+
+def write_message_batch(tx, messages, channel_id, channel_dir):
+    message_rows, media_rows, transcript_rows = neo4j_message_rows(messages, channel_dir)
+    tx.run(NEO4J_MESSAGES_QUERY, channel_id=channel_id, rows=message_rows)
+    if media_rows:
+        tx.run(NEO4J_MEDIA_QUERY, rows=media_rows)
+    if transcript_rows:
+        tx.run(NEO4J_TRANSCRIPTS_QUERY, rows=transcript_rows)
+    return {'message': len(message_rows), 'media': len(media_rows), 'transcript': len(transcript_rows)}
+
+def write_comment_batch(tx, comments):
+    comment_rows = [{'id': str(comment_id), 'text': comment_text, 'preview': text_preview(comment_text),
+                     'sender_name': display_sender_name(sender_id, first_name, last_name, username),
+                     'username': username, 'message_id': str(message_id)}
+                    for (comment_id, message_id, comment_text, sender_id, first_name,
+                         last_name, username) in comments]
+    tx.run(NEO4J_COMMENTS_QUERY, rows=comment_rows)
+    return {'comment': len(comment_rows)}
+
+def create_neo4j_schema(session):
+    """Uniqueness constraints for the MERGE lookups and full-text indexes for search"""
+    try:
+        # Every MERGE and MATCH looks nodes up by id, which is a full scan without these
+        for name, label in NEO4J_CONSTRAINTS.items():
+            session.run(f"CREATE CONSTRAINT {name} IF NOT EXISTS FOR (n:{label}) REQUIRE n.id IS UNIQUE")
+    except Exception as e:
+        print(f"Warning: Could not create uniqueness constraints: {str(e)}")
+    
+    try:
+        # Create index for Message nodes
+        session.run("""
+            CREATE FULLTEXT INDEX message_content IF NOT EXISTS
+            FOR (n:Message)
+            ON EACH [n.message]
+        """)
+        
+        # Create index for Comment nodes
+        session.run("""
+            CREATE FULLTEXT INDEX comment_content IF NOT EXISTS
+            FOR (n:Comment)
+            ON EACH [n.text]
+        """)
+
+        # Create index for Transcript nodes
+        session.run("""
+            CREATE FULLTEXT INDEX transcript_content IF NOT EXISTS
+            FOR (n:Transcript)
+            ON EACH [n.transcript]
+        """)
+    except Exception as e:
+        print(f"Warning: Could not create full-text indexes: {str(e)}")
+
 async def upload_to_neo4j(channel_id):
-    """Upload channel data to Neo4j"""
+    """Upload channel data to Neo4j.
+
+    Rows are streamed out of SQLite and sent with UNWIND in batched
+    transactions (see Neo4jBatcher), rather than one query per node.
+    """
     try:
+        from neo4j import GraphDatabase
+        
         neo4j_config = state.get('neo4j', {})
         if not neo4j_config or not neo4j_config.get('url') or not neo4j_config.get('password'):
             print("Neo4j connection details not found in state.json")
@@ -767,6 +3558,7 @@ async def upload_to_neo4j(channel_id):
             return
             
         # Connect to Neo4j
+        started = time.monotonic()
         driver = GraphDatabase.driver(
             neo4j_config['url'],
             auth=("neo4j", neo4j_config['password'])
@@ -774,33 +3566,11 @@ async def upload_to_neo4j(channel_id):
         
         # Connect to SQLite
         conn = sqlite3.connect(db_file)
+        migrate_db(conn)
         c = conn.cursor()
         
-        with driver.session() as session:
-            # Create full-text search indexes if they don't exist
-            try:
-                # Create index for Message nodes
-                session.run("""
-                    CREATE FULLTEXT INDEX message_content IF NOT EXISTS
-                    FOR (n:Message)
-                    ON EACH [n.message]
-                """)
-                
-                # Create index for Comment nodes
-                session.run("""
-                    CREATE FULLTEXT INDEX comment_content IF NOT EXISTS
-                    FOR (n:Comment)
-                    ON EACH [n.text]
-                """)
-
-                # Create index for Transcript nodes
-                session.run("""
-                    CREATE FULLTEXT INDEX transcript_content IF NOT EXISTS
-                    FOR (n:Transcript)
-                    ON EACH [n.transcript]
-                """)
-            except Exception as e:
-                print(f"Warning: Could not create full-text indexes: {str(e)}")
+        with tracer.span('upload_to_neo4j', channel_id=str(channel_id)), driver.session() as session:
+            create_neo4j_schema(session)
             
             # Get channel name from state
             channel_name = state.get('channel_details', {}).get(str(channel_id), {}).get('title', str(channel_id))
@@ -812,117 +3582,27 @@ async def upload_to_neo4j(channel_id):
                     c.name = $channel_name
             """, channel_id=str(channel_id), channel_name=channel_name)
             
-            # Get and create Message nodes with Media and Transcript relationships
-            c.execute('''SELECT message_id, date, message, media_type, media_path, mime_type, transcript, reply_to,
-                               sender_id, first_name, last_name, username 
-                        FROM messages''')
-            messages = c.fetchall()
-            
-            for msg in messages:
-                (msg_id, date, message_text, media_type, media_path, mime_type, transcript, reply_to,
-                 sender_id, first_name, last_name, username) = msg
-                
-                # Skip messages without text content (like channel creation messages)
-                if not message_text and not media_path:
-                    continue
-
-                # Create display name for sender
-                sender_name = ' '.join(filter(None, [first_name, last_name])) if first_name or last_name else username or str(sender_id)
-                
-                # Create preview text (truncate at 50 chars)
-                preview_text = (message_text[:47] + "...") if message_text and len(message_text) > 50 else message_text
-                
-                # Create Message node with sender info and preview
-                session.run("""
-                    MERGE (m:Message {id: $msg_id})
-                    SET m.date = $date,
-                        m.message = $message_text,
-                        m.preview = $preview_text,
-                        m.reply_to = $reply_to,
-                        m.sender_name = $sender_name,
-                        m.username = $username
-                    WITH m
-                    MATCH (c:Channel {id: $channel_id})
-                    MERGE (c)-[:HAS_MESSAGE]->(m)
-                """, msg_id=str(msg_id), date=date, message_text=message_text, preview_text=preview_text,
-                     reply_to=str(reply_to) if reply_to else None, channel_id=str(channel_id),
-                     sender_name=sender_name, username=username)
-                
-                # If there's media, create Media node with better labels
-                if media_path:
-                    # Create hash from media path for unique ID
-                    import hashlib
-                    media_hash = hashlib.md5(media_path.encode()).hexdigest()
-                    
-                    # Get absolute path for file:/// URL
-                    abs_path = os.path.abspath(os.path.join(channel_dir, 'media', media_path))
-                    file_url = f"file:///{abs_path.replace(os.sep, '/')}"
-                    
-                    # Get filename for label
-                    filename = os.path.basename(media_path)
-                    
-                    # Create Media node with appropriate properties
-                    media_props = {
-                        'id': media_hash,
-                        'type': media_type,
-                        'mime_type': mime_type,
-                        'path': media_path,
-                        'filename': filename
-                    }
-                    
-                    # Add thumbnail for images
-                    if mime_type and mime_type.startswith('image/'):
-                        media_props['thumbnail'] = file_url
-                    
-                    session.run("""
-                        MERGE (media:Media {id: $id})
-                        SET media += $props
-                        WITH media
-                        MATCH (m:Message {id: $msg_id})
-                        MERGE (m)-[:HAS_MEDIA]->(media)
-                    """, id=media_hash, props=media_props, msg_id=str(msg_id))
-                    
-                    # If there's a transcript, create Transcript node with preview
-                    if transcript:
-                        transcript_hash = hashlib.md5(f"{media_hash}_transcript".encode()).hexdigest()
-                        transcript_preview = (transcript[:47] + "...") if len(transcript) > 50 else transcript
-                        
-                        session.run("""
-                            MERGE (t:Transcript {id: $id})
-                            SET t.transcript = $transcript,
-                                t.preview = $preview
-                            WITH t
-                            MATCH (media:Media {id: $media_id})
-                            MERGE (media)-[:HAS_TRANSCRIPT]->(t)
-                        """, id=transcript_hash, transcript=transcript, preview=transcript_preview, media_id=media_hash)
+            batcher = Neo4jBatcher(session)
             
-            # Get and create Comment nodes with sender info and preview
-            c.execute('''SELECT comment_id, message_id, comment_text, sender_id, first_name, last_name, username 
-                        FROM comments''')
-            comments = c.fetchall()
+            # Message nodes with their Media and Transcript nodes, skipping messages
+            # without text or media (like channel creation messages)
+            c.execute('''SELECT m.message_id, m.date, m.message, m.media_type, m.media_path, m.mime_type, 
+                               m.transcript, m.reply_to, m.sender_id, s.first_name, s.last_name, s.username 
+                        FROM messages m LEFT JOIN senders s ON s.sender_id = m.sender_id
+                        WHERE m.message != '' OR m.media_path != '' ''')
+            for messages in batcher.chunks(iter_rows(c)):
+                await batcher.write(write_message_batch, messages, str(channel_id), channel_dir)
             
-            for comment in comments:
-                comment_id, message_id, comment_text, sender_id, first_name, last_name, username = comment
-                
-                # Create display name for commenter
-                sender_name = ' '.join(filter(None, [first_name, last_name])) if first_name or last_name else username or str(sender_id)
-                
-                # Create preview text
-                preview_text = (comment_text[:47] + "...") if comment_text and len(comment_text) > 50 else comment_text
-                
-                session.run("""
-                    MERGE (c:Comment {id: $comment_id})
-                    SET c.text = $comment_text,
-                        c.preview = $preview_text,
-                        c.sender_name = $sender_name,
-                        c.username = $username
-                    WITH c
-                    MATCH (m:Message {id: $message_id})
-                    MERGE (m)-[:HAS_COMMENT]->(c)
-                """, comment_id=str(comment_id), comment_text=comment_text, preview_text=preview_text,
-                     sender_name=sender_name, username=username, message_id=str(message_id))
-        
-        print(f"Successfully uploaded channel {channel_id} to Neo4j")
+            # Comment nodes with sender info and preview
+            c.execute('''SELECT c.comment_id, c.message_id, c.comment_text, c.sender_id, s.first_name, 
+                               s.last_name, s.username 
+                        FROM comments c LEFT JOIN senders s ON s.sender_id = c.sender_id''')
+            for comments in batcher.chunks(iter_rows(c)):
+                await batcher.write(write_comment_batch, comments)
+        
+        NEO4J_UPLOAD_SECONDS.observe(time.monotonic() - started)
+        print(f"Successfully uploaded channel {channel_id} to Neo4j in {batcher.batches} batches "
+              f"({batcher.retries} retries, batch size ended at {batcher.batch_size})")
         driver.close()
         conn.close()
         
@@ -932,6 +3612,8 @@ async def upload_to_neo4j(channel_id):
 async def setup_neo4j_connection():
     """Setup Neo4j connection details"""
     try:
+        from neo4j import GraphDatabase
+        
         # Use existing credentials if available
         neo4j_config = state.get('neo4j', {})
         if neo4j_config.get('url') and neo4j_config.get('password'):
@@ -978,6 +3660,9 @@ async def setup_neo4j_connection():
 
 async def get_media_files(channel_id):
     """Get all media files for a channel that haven't been transcribed"""
+    return await db_thread.run(find_untranscribed_media, channel_id)
+
+def find_untranscribed_media(channel_id):
     channel_dir = os.path.join(os.getcwd(), str(channel_id))
     media_dir = os.path.join(channel_dir, 'media')
     
@@ -991,28 +3676,9 @@ async def get_media_files(channel_id):
     print(f"Checking database: {db_file}")
     
     conn = sqlite3.connect(db_file)
+    migrate_db(conn)
     c = conn.cursor()
     
-    # Add transcript and mime_type columns if they don't exist
-    c.execute('''
-        SELECT name FROM sqlite_master 
-        WHERE type='table' AND name='messages'
-    ''')
-    if c.fetchone():
-        c.execute('''
-            SELECT sql FROM sqlite_master 
-            WHERE type='table' AND name='messages'
-        ''')
-        create_stmt = c.fetchone()[0]
-        if 'transcript' not in create_stmt:
-            print("Adding transcript column to messages table")
-            c.execute('ALTER TABLE messages ADD COLUMN transcript TEXT')
-            conn.commit()
-        if 'mime_type' not in create_stmt:
-            print("Adding mime_type column to messages table")
-            c.execute('ALTER TABLE messages ADD COLUMN mime_type TEXT')
-            conn.commit()
-    
     # Get files that need transcription
     print("\nChecking for media files that need transcription...")
     
@@ -1078,6 +3744,7 @@ async def get_media_files(channel_id):
 def extract_audio(video_path, output_path):
     """Extract audio from video using imageio-ffmpeg"""
     import subprocess
+    import imageio_ffmpeg
     
     ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
     
@@ -1110,8 +3777,29 @@ def extract_audio(video_path, output_path):
     
     return output_path
 
+def save_transcript(conn, media_filename, transcript):
+    c = conn.cursor()
+    seq = next_change_seq(c)
+    c.execute('''
+        UPDATE messages
+        SET transcript = ?, change_seq = ?
+        WHERE media_path = ?
+    ''', (transcript, seq, media_filename))
+    if c.rowcount == 0:
+        # Older rows may hold a full path rather than just the file name
+        c.execute('''
+            UPDATE messages 
+            SET transcript = ?, change_seq = ? 
+            WHERE media_path LIKE ?
+        ''', (transcript, seq, f'%{media_filename}'))
+    conn.commit()
+
 async def transcribe_media(channel_id):
     try:
+        import whisper
+        import numpy as np
+        import soundfile as sf
+        
         print(f"\nInitializing Whisper model ({state['whisper_model']})...")
         model = whisper.load_model(state['whisper_model'])
         
@@ -1128,8 +3816,7 @@ async def transcribe_media(channel_id):
         
         # Connect to database
         db_file = os.path.join(channel_dir, f'{channel_id}.db')
-        conn = sqlite3.connect(db_file)
-        c = conn.cursor()
+        conn = await db_thread.run(sqlite3.connect, db_file)
         
         for i, media_filename in enumerate(files, 1):
             try:
@@ -1151,7 +3838,8 @@ async def transcribe_media(channel_id):
                     audio_path = os.path.join(temp_dir, audio_filename)
                     print(f"Extracting audio...")
                     
-                    extract_audio(video_path, audio_path)
+                    with tracer.span('extract_audio', channel_id=str(channel_id), file=media_filename):
+                        extract_audio(video_path, audio_path)
                     
                     # Load and transcribe the audio
                     print("Loading audio...")
@@ -1162,16 +3850,15 @@ async def transcribe_media(channel_id):
                         audio_data = whisper.pad_or_trim(audio_data)
                     
                     print("Transcribing audio...")
-                    result = model.transcribe(audio_data, fp16=False)
+                    started = time.monotonic()
+                    with tracer.span('transcribe', channel_id=str(channel_id), file=media_filename):
+                        result = model.transcribe(audio_data, fp16=False)
+                    if len(audio_data):
+                        TRANSCRIPTION_RTF.observe((time.monotonic() - started) / (len(audio_data) / sample_rate))
                     transcript = result["text"].strip()
                     
                     # Update database with transcript
-                    c.execute('''
-                        UPDATE messages 
-                        SET transcript = ? 
-                        WHERE media_path LIKE ?
-                    ''', (transcript, f'%{media_filename}'))
-                    conn.commit()
+                    await db_thread.run(save_transcript, conn, media_filename, transcript)
                     
                     print(f"Transcription successful: {len(transcript)} characters")
                     print(f"Transcript preview: {transcript[:200]}..." if len(transcript) > 200 else f"Transcript: {transcript}")
@@ -1195,7 +3882,7 @@ async def transcribe_media(channel_id):
                 print(f"Full error: {sys.exc_info()}")
                 continue
         
-        conn.close()
+        await db_thread.run(conn.close)
         print("\nTranscription complete!")
         
         # Clean up temp directory
@@ -1221,19 +3908,25 @@ WHISPER_MODELS = {
 def reset_telegram_account():
     """Reset Telegram account details"""
     global state
-    # Remove session file
-    if os.path.exists('session'):
-        os.remove('session')
-    if os.path.exists('session.session'):
-        os.remove('session.session')
+    # Remove session files, including those of any extra accounts
+    for session in [PRIMARY_SESSION] + [account['session'] for account in state['accounts']]:
+        if os.path.exists(session):
+            os.remove(session)
+        if os.path.exists(f'{session}.session'):
+            os.remove(f'{session}.session')
     
     # Clear Telegram-related state
     state['api_id'] = None
     state['api_hash'] = None
     state['phone'] = None
+    state['accounts'] = []
     state['channels'] = {}
     state['channel_details'] = {}
+    state['poll_schedule'] = {}
+    state['backfills'] = {}
     save_state(state)
+    # Access hashes belong to the account, so cached entities are no longer valid
+    entity_cache.clear()
     print("\nTelegram account details have been reset.")
     print("You will need to re-enter your API credentials on next startup.")
 
@@ -1250,7 +3943,7 @@ def reset_neo4j_connection():
 
 def wipe_local_data():
     """Wipe all local databases and channel folders"""
-    global state
+    global state, media_store
     
     # Get list of channel IDs/names from state
     channel_ids = list(state['channels'].keys())
@@ -1281,8 +3974,81 @@ def wipe_local_data():
             except Exception as e:
                 print(f"Error deleting {channel_dir}: {e}")
     
+    # Delete the shared media store the channel folders link into
+    if media_store is not None:
+        db_thread.call(media_store.conn.close)
+        media_store = None
+    store_dir = os.path.join(os.getcwd(), MEDIA_STORE_DIR)
+    if os.path.exists(store_dir):
+        try:
+            shutil.rmtree(store_dir)
+            print(f"Deleted folder: {store_dir}")
+        except Exception as e:
+            print(f"Error deleting {store_dir}: {e}")
+    
+    # Export watermarks point into the deleted databases
+    state['exports'] = {}
+    save_state(state)
+    
     print("\nLocal data has been wiped.")
 
+async def manage_accounts():
+    """Add or remove the extra accounts that channels are spread across"""
+    while True:
+        print("\nAccounts:")
+        print(f"- {PRIMARY_SESSION}: {state['phone']} (main account)")
+        for account in state['accounts']:
+            limited = " (flood-limited)" if pool.is_limited(account['session']) else ""
+            print(f"- {account['session']}: {account['phone']}{limited}")
+        print("\n[A] Add Account")
+        print("[R] Remove Account")
+        print("[B] Back to Main Menu")
+        
+        choice = input("\nEnter your choice: ").upper()
+        
+        if choice == 'A':
+            try:
+                account = {
+                    'api_id': int(input("Enter the account's API ID: ")),
+                    'api_hash': input("Enter the account's API Hash: "),
+                    'phone': input("Enter the account's phone number: ")
+                }
+            except ValueError:
+                print("Invalid API ID.")
+                continue
+            sessions = {PRIMARY_SESSION} | {a['session'] for a in state['accounts']}
+            number = 2
+            while f"session-{number}" in sessions:
+                number += 1
+            account['session'] = f"session-{number}"
+            try:
+                account_client = create_client(account)
+                await account_client.start(phone=account['phone'])
+            except Exception as e:
+                print(f"Could not sign in to {account['phone']}: {e}")
+                continue
+            pool.add(account['session'], account_client, account['phone'])
+            state['accounts'].append(account)
+            save_state(state)
+            print(f"Added account {account['session']}; some channels will now be scraped through it")
+        
+        elif choice == 'R':
+            session = input("Enter the session name to remove: ").strip()
+            account = next((a for a in state['accounts'] if a['session'] == session), None)
+            if not account:
+                print("No extra account with that session name. The main account can't be removed here.")
+                continue
+            await pool.remove(session).disconnect()
+            state['accounts'].remove(account)
+            save_state(state)
+            print(f"Removed account {session}")
+        
+        elif choice == 'B':
+            break
+        
+        else:
+            print("Invalid choice. Please try again.")
+
 async def reset_menu():
     """Reset menu for various reset operations"""
     while True:
@@ -1317,7 +4083,9 @@ async def reset_menu():
             print("Invalid choice. Please try again.")
 
 async def main():
-    await client.start()
+    start_metrics()
+    start_tracing()
+    await pool.start()
     try:
         await main_menu()
     except KeyboardInterrupt:
@@ -1325,8 +4093,11 @@ async def main():
         # Ensure continuous scraping is stopped
         global continuous_scraping_active
         continuous_scraping_active = False
+    finally:
+        checkpoints.flush()
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -6,11 +6,16 @@ numba_hiddenimports = collect_submodules('numba')
 
 datas = []
 binaries = []
-# Combine your existing hidden imports with those collected from numba
+# Combine your existing hidden imports with those collected from numba.
+# The script imports whisper, neo4j, imageio_ffmpeg and pyarrow inside the functions
+# that use them so startup stays fast; listing them here keeps them in the bundle.
 hiddenimports = [
     'imageio_ffmpeg',
     'whisper',
     'neo4j',
+    'numpy',
+    'soundfile',
+    'pyarrow',
     'telethon'
 ] + numba_hiddenimports
 